@@ -0,0 +1,122 @@
+import asyncio
+import math
+import os
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Iterator
+from fastapi import HTTPException
+from resilience import LatencyTracker, TokenBucket
+
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", 30))
+
+# background jobs have no client to hand a Retry-After to, so they wait for capacity instead
+waits_for_capacity: ContextVar[bool] = ContextVar("waits_for_capacity", default=False)
+
+@contextmanager
+def background_work() -> Iterator[None]:
+    token = waits_for_capacity.set(True)
+    try:
+        yield
+    finally:
+        waits_for_capacity.reset(token)
+
+class Overloaded(HTTPException):
+    def __init__(self, name: str, retry_after: int):
+        super().__init__(
+            status_code=429,
+            detail=f"{name} is at capacity, retry in {retry_after} s.",
+            headers={"Retry-After": str(retry_after)}
+        )
+
+class AdmissionController:
+    # a concurrency cap in front of a token bucket, with a bounded queue of callers waiting for either;
+    # callers beyond the queue are turned away straight away instead of piling up until they time out
+    def __init__(self, name: str, bucket: TokenBucket, concurrency: int, max_queue: int, max_wait: float = ADMISSION_MAX_WAIT):
+        self.name = name
+        self.bucket = bucket
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.waiting = 0
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.wait_times = LatencyTracker(min_samples=1)
+
+    def retry_after(self) -> int:
+        # roughly how long the callers already queued take to drain through the bucket
+        return max(1, math.ceil((self.waiting + 1) / self.bucket.rate))
+
+    def check(self):
+        if self.waiting >= self.max_queue and not waits_for_capacity.get():
+            self.rejected += 1
+            raise Overloaded(self.name, self.retry_after())
+
+    @asynccontextmanager
+    async def slot(self, cost: int = 1) -> AsyncIterator[None]:
+        self.check()
+
+        self.waiting += 1
+        start = time.monotonic()
+        try:
+            try:
+                await asyncio.wait_for(self.semaphore.acquire(), None if waits_for_capacity.get() else self.max_wait)
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                raise Overloaded(self.name, self.retry_after())
+
+            try:
+                await asyncio.sleep(self.bucket.reserve(cost))
+            except BaseException:
+                self.semaphore.release()
+                raise
+        finally:
+            self.waiting -= 1
+
+        self.wait_times.record(time.monotonic() - start)
+        self.admitted += 1
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self.semaphore.release()
+
+    def stats(self) -> dict:
+        p50 = self.wait_times.percentile(0.5)
+        p95 = self.wait_times.percentile(0.95)
+        return {
+            "queued": self.waiting,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "concurrency": self.concurrency,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "tokens": round(self.bucket.available(), 2),
+            "wait_p50_ms": round(p50 * 1000) if p50 is not None else None,
+            "wait_p95_ms": round(p95 * 1000) if p95 is not None else None
+        }
+
+hyperbolic_bucket = TokenBucket(float(os.getenv("HYPERBOLIC_RATE", 2)), int(os.getenv("HYPERBOLIC_BURST", 10)))
+groq_bucket = TokenBucket(float(os.getenv("GROQ_RATE", 0.5)), int(os.getenv("GROQ_BURST", 5)))
+
+describe_admission = AdmissionController(
+    "Image description",
+    hyperbolic_bucket,
+    int(os.getenv("DESCRIBE_CONCURRENCY", 8)),
+    int(os.getenv("DESCRIBE_QUEUE", 32))
+)
+generate_admission = AdmissionController(
+    "Image generation",
+    hyperbolic_bucket,
+    int(os.getenv("GENERATE_CONCURRENCY", 4)),
+    int(os.getenv("GENERATE_QUEUE", 16))
+)
+recommendation_admission = AdmissionController(
+    "Recommendations",
+    groq_bucket,
+    int(os.getenv("RECOMMENDATION_CONCURRENCY", 4)),
+    int(os.getenv("RECOMMENDATION_QUEUE", 16))
+)
@@ -0,0 +1,97 @@
+import hashlib
+import os
+import re
+import time
+from typing import Union
+import httpx
+from firebase_admin import db
+from cache import MISSING, TTLCache
+from fanout import fanout_executor
+from covers import city_key
+from places import search_place
+from schemas import Geocode, Place
+import geohash
+
+ATTRACTION_INDEX = "attraction_geo"
+# entries are keyed by the place's full geohash, a covering cell is one key-prefix range query
+ATTRACTION_PRECISION = 9
+ATTRACTION_MAX_QUERIES = int(os.getenv("ATTRACTION_MAX_QUERIES", 8))
+ATTRACTION_RADIUS_KM = float(os.getenv("ATTRACTION_RADIUS_KM", 15))
+ATTRACTION_MIN_COVERAGE = int(os.getenv("ATTRACTION_MIN_COVERAGE", 5))
+ATTRACTION_MAX_AGE = float(os.getenv("ATTRACTION_MAX_AGE", 30 * 24 * 60 * 60))
+ATTRACTION_RESULTS = int(os.getenv("ATTRACTION_RESULTS", 5))
+
+area_center_cache = TTLCache(
+    maxsize=int(os.getenv("AREA_CENTER_CACHE_SIZE", 5000)),
+    ttl=float(os.getenv("AREA_CENTER_CACHE_TTL", 7 * 24 * 60 * 60))
+)
+
+def keyword_tags(query: Union[str, None]) -> set[str]:
+    return set(re.findall(r"\w+", query.lower())) if query else set()
+
+def place_key(place: Place) -> str:
+    return hashlib.sha1(place.google_maps_uri.encode("utf-8")).hexdigest()[:16]
+
+async def area_center(city: str, state: str, lat: Union[float, None] = None, lng: Union[float, None] = None) -> Union[Geocode, None]:
+    if lat is not None and lng is not None:
+        return Geocode(lat=lat, lng=lng)
+
+    key = city_key(city, state)
+    center = area_center_cache.get(key)
+    if center is MISSING:
+        try:
+            place = await search_place(f"{city}, {state}")
+        except httpx.HTTPError as e:
+            # without a centre the request just skips the shared index
+            print(f"Area centre lookup failed for {city}, {state}: {e!r}")
+            return None
+        center = place.geocode if place is not None else None
+        area_center_cache.set(key, center)
+    return center
+
+def entry_key(place: Place) -> str:
+    return f"{geohash.encode(place.geocode.lat, place.geocode.lng, ATTRACTION_PRECISION)}_{place_key(place)}"
+
+def query_cell(cell: str) -> dict:
+    ref = db.reference(f"/{ATTRACTION_INDEX}")
+    return ref.order_by_key().start_at(cell).end_at(cell + "~").get() or {}
+
+def find_nearby(center: Geocode, query: Union[str, None] = None) -> Union[list[Place], None]:
+    # answers from the shared index only when the area is already well covered
+    box = geohash.bounding_box(center.lat, center.lng, ATTRACTION_RADIUS_KM)
+    cells = sorted(geohash.covering_cells(*box, max_cells=ATTRACTION_MAX_QUERIES))
+    results = list(fanout_executor.map(query_cell, cells))
+
+    tags = keyword_tags(query)
+    oldest = (time.time() - ATTRACTION_MAX_AGE) * 1000
+    matches = {}
+    for result in results:
+        for key, entry in result.items():
+            place = entry.get("place")
+            if not place or entry.get("updated_at", 0) < oldest:
+                continue
+            if tags and not tags & set(entry.get("tags") or {}):
+                continue
+
+            geocode = place["geocode"]
+            if geohash.distance_km(center.lat, center.lng, geocode["lat"], geocode["lng"]) <= ATTRACTION_RADIUS_KM:
+                matches[key] = Place(**place)
+
+    if len(matches) < ATTRACTION_MIN_COVERAGE:
+        return None
+
+    return sorted(matches.values(), key=lambda place: place.rating, reverse=True)[:ATTRACTION_RESULTS]
+
+def store_places(places: list[Place], query: Union[str, None] = None):
+    updates = {}
+    for place in places:
+        path = f"{ATTRACTION_INDEX}/{entry_key(place)}"
+        updates[f"{path}/place"] = place.model_dump()
+        updates[f"{path}/rating"] = place.rating
+        updates[f"{path}/updated_at"] = {".sv": "timestamp"}
+        # tag paths are merged, so a place found by several searches keeps every keyword
+        for tag in keyword_tags(query):
+            updates[f"{path}/tags/{tag}"] = True
+
+    if updates:
+        db.reference("/").update(updates)
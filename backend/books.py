@@ -0,0 +1,52 @@
+import time
+from typing import Union
+from firebase_admin import db
+from stamps import book_index_path, book_index_root, count_stamps, push_id
+
+SUMMARY_FIELDS = ("city", "state", "cover", "cover_status")
+
+def book_summary(book: dict) -> dict:
+    return {
+        **{field: book.get(field) for field in SUMMARY_FIELDS},
+        "stamp_count": count_stamps(book.get("pages")),
+        "last_updated": int(time.time() * 1000)
+    }
+
+def create_book_record(uid: str, book: dict) -> str:
+    book_id = push_id()
+    db.reference("/").update({
+        f"users/{uid}/books/{book_id}": book,
+        book_index_path(uid, book_id): book_summary(book)
+    })
+    return book_id
+
+def update_book_record(uid: str, book_id: str, fields: dict):
+    updates = {f"users/{uid}/books/{book_id}/{field}": value for field, value in fields.items()}
+    updates.update({
+        f"{book_index_path(uid, book_id)}/{field}": value for field, value in fields.items() if field in SUMMARY_FIELDS
+    })
+    db.reference("/").update(updates)
+
+def rebuild_book_index(uid: str, book_ids: list[str]) -> dict[str, dict]:
+    # books created before the index existed are summarized once from the full record
+    summaries = {}
+    for book_id in book_ids:
+        book = db.reference(f"/users/{uid}/books/{book_id}").get()
+        if book is not None:
+            summaries[book_id] = book_summary(book)
+
+    if summaries:
+        db.reference(f"/{book_index_root(uid)}").update(summaries)
+    return summaries
+
+def list_books(uid: str) -> Union[dict[str, dict], None]:
+    index = db.reference(f"/{book_index_root(uid)}").get() or {}
+    book_ids = db.reference(f"/users/{uid}/books").get(shallow=True)
+    if not book_ids:
+        return None
+
+    missing = [book_id for book_id in book_ids if "city" not in index.get(book_id, {})]
+    if missing:
+        index.update(rebuild_book_index(uid, missing))
+
+    return {book_id: index[book_id] for book_id in book_ids if book_id in index}
@@ -0,0 +1,99 @@
+import os
+import random
+import re
+import time
+import uuid
+from typing import Union
+from fastapi.concurrency import run_in_threadpool
+from firebase_admin import db
+from admission import background_work
+from books import update_book_record
+from cache import MISSING, SingleFlight, TTLCache
+from pipeline import QUALITY_TIERS, generate_image, upload_image
+
+COVER_VARIANTS = int(os.getenv("COVER_VARIANTS", 1))
+# covers are shared by every book of a city, so they can afford a slower tier
+COVER_QUALITY = os.getenv("COVER_QUALITY", "standard")
+if COVER_QUALITY not in QUALITY_TIERS:
+    raise ValueError(f"COVER_QUALITY must be one of {', '.join(QUALITY_TIERS)}")
+
+cover_library_cache = TTLCache(
+    maxsize=int(os.getenv("COVER_LIBRARY_CACHE_SIZE", 2000)),
+    ttl=float(os.getenv("COVER_LIBRARY_CACHE_TTL", 10 * 60))
+)
+cover_flight = SingleFlight()
+
+US_STATES = {
+    "alabama": "al", "alaska": "ak", "arizona": "az", "arkansas": "ar", "california": "ca",
+    "colorado": "co", "connecticut": "ct", "delaware": "de", "district of columbia": "dc",
+    "florida": "fl", "georgia": "ga", "hawaii": "hi", "idaho": "id", "illinois": "il",
+    "indiana": "in", "iowa": "ia", "kansas": "ks", "kentucky": "ky", "louisiana": "la",
+    "maine": "me", "maryland": "md", "massachusetts": "ma", "michigan": "mi", "minnesota": "mn",
+    "mississippi": "ms", "missouri": "mo", "montana": "mt", "nebraska": "ne", "nevada": "nv",
+    "new hampshire": "nh", "new jersey": "nj", "new mexico": "nm", "new york": "ny",
+    "north carolina": "nc", "north dakota": "nd", "ohio": "oh", "oklahoma": "ok", "oregon": "or",
+    "pennsylvania": "pa", "rhode island": "ri", "south carolina": "sc", "south dakota": "sd",
+    "tennessee": "tn", "texas": "tx", "utah": "ut", "vermont": "vt", "virginia": "va",
+    "washington": "wa", "west virginia": "wv", "wisconsin": "wi", "wyoming": "wy"
+}
+
+def normalize_state(state: str) -> str:
+    state = re.sub(r"[^a-z ]+", " ", state.lower())
+    state = re.sub(r"\s+", " ", state).strip()
+    return US_STATES.get(state, state)
+
+def city_key(city: str, state: str) -> str:
+    # safe to use as an RTDB key, "San Diego, California" and "san diego, CA" both give "san-diego-ca"
+    return re.sub(r"[^a-z0-9]+", "-", f"{city.lower()} {normalize_state(state)}").strip("-")
+
+def cover_prompt(city: str, state: str) -> str:
+    return f"make an illustration of {city}, {state}, include landmarks"
+
+async def get_cover_library(key: str) -> list[str]:
+    library = cover_library_cache.get(key)
+    if library is MISSING:
+        variants = await run_in_threadpool(db.reference(f"/covers/{key}").get) or {}
+        library = [variant["blob"] for variant in variants.values() if variant.get("blob")]
+        cover_library_cache.set(key, library)
+    return library
+
+async def find_cover(city: str, state: str) -> Union[str, None]:
+    # books store the blob path, the URL is signed whenever the book is read
+    library = await get_cover_library(city_key(city, state))
+    if len(library) >= COVER_VARIANTS:
+        return random.choice(library)
+    return None
+
+async def get_cover(city: str, state: str) -> str:
+    blob_name = await find_cover(city, state)
+    if blob_name is not None:
+        return blob_name
+
+    key = city_key(city, state)
+
+    async def render():
+        image_data = await generate_image(cover_prompt(city, state), COVER_QUALITY)
+        blob_name = await upload_image(image_data, f"covers/{key}/{uuid.uuid4().hex}")
+        await run_in_threadpool(db.reference(f"/covers/{key}").push, {"blob": blob_name, "created_at": time.time()})
+        cover_library_cache.set(key, await get_cover_library(key) + [blob_name])
+        return blob_name
+
+    # concurrent first books for the same city share one render
+    return await cover_flight.do(key, render)
+
+async def fill_cover(uid: str, book_id: str, city: str, state: str):
+    # runs after the response went out, nobody is left to retry a 429 so it waits for capacity instead
+    try:
+        with background_work():
+            blob_name = await get_cover(city, state)
+    except Exception as e:
+        print(f"Cover generation failed for book {book_id}: {e}")
+        await run_in_threadpool(update_book_record, uid, book_id, {"cover_status": "failed"})
+        return
+
+    await run_in_threadpool(update_book_record, uid, book_id, {"cover": blob_name, "cover_status": "ready"})
+
+async def retry_cover(uid: str, book_id: str, city: str, state: str):
+    # a failed render isn't final, it is tried again the next time the client looks at the book
+    await run_in_threadpool(update_book_record, uid, book_id, {"cover_status": "pending"})
+    await fill_cover(uid, book_id, city, state)
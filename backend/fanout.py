@@ -0,0 +1,8 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# RTDB reads and URL signing fan out from code that already runs on anyio's threadpool; they share
+# this one bounded pool instead of each request starting threads of its own
+FANOUT_WORKERS = int(os.getenv("FANOUT_WORKERS", 16))
+
+fanout_executor = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix="fanout")
@@ -0,0 +1,58 @@
+from firebase_admin import db
+from fanout import fanout_executor
+import geohash
+
+GEO_PRECISION = 9
+
+def geo_index_path(uid: str) -> str:
+    return f"stamp_geo/{uid}"
+
+def geo_index_updates(uid: str, book_id: str, stamp_id: str, stamp: dict) -> dict:
+    # keys start with the stamp's geohash so a cell is one key-prefix range query
+    geocode = stamp["geocode"]
+    key = f"{geohash.encode(geocode['lat'], geocode['lng'], GEO_PRECISION)}_{stamp_id}"
+    return {
+        f"{geo_index_path(uid)}/{key}": {
+            "lat": geocode["lat"],
+            "lng": geocode["lng"],
+            "book_id": book_id,
+            "stamp_id": stamp_id,
+            "location_name": stamp["location_name"],
+            "stamp_url": stamp.get("stamp_url")
+        }
+    }
+
+def query_cell(uid: str, cell: str) -> dict:
+    ref = db.reference(f"/{geo_index_path(uid)}")
+    return ref.order_by_key().start_at(cell).end_at(cell + "~").get() or {}
+
+def stamps_in_box(uid: str, min_lat: float, min_lng: float, max_lat: float, max_lng: float) -> list[dict]:
+    cells = sorted(geohash.covering_cells(min_lat, min_lng, max_lat, max_lng))
+    results = list(fanout_executor.map(lambda cell: query_cell(uid, cell), cells))
+
+    stamps = {}
+    for result in results:
+        for key, entry in result.items():
+            if min_lat <= entry["lat"] <= max_lat and min_lng <= entry["lng"] <= max_lng:
+                stamps[key] = entry
+    return list(stamps.values())
+
+def stamps_near(uid: str, lat: float, lng: float, radius_km: float) -> list[dict]:
+    stamps = stamps_in_box(uid, *geohash.bounding_box(lat, lng, radius_km))
+    return [stamp for stamp in stamps if geohash.distance_km(lat, lng, stamp["lat"], stamp["lng"]) <= radius_km]
+
+def cluster_stamps(stamps: list[dict], precision: int) -> list[dict]:
+    clusters: dict[str, list[dict]] = {}
+    for stamp in stamps:
+        clusters.setdefault(geohash.encode(stamp["lat"], stamp["lng"], precision), []).append(stamp)
+
+    return [
+        {
+            "geohash": cell,
+            "count": len(members),
+            "lat": sum(member["lat"] for member in members) / len(members),
+            "lng": sum(member["lng"] for member in members) / len(members),
+            "stamps": members if len(members) == 1 else None
+        }
+        for cell, members in sorted(clusters.items())
+    ]
@@ -0,0 +1,102 @@
+import math
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+def encode(lat: float, lng: float, precision: int = 9) -> str:
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bit = 0
+    value = 0
+    even = True
+
+    while len(chars) < precision:
+        # bits alternate between longitude and latitude, starting with longitude
+        interval = lng_range if even else lat_range
+        coordinate = lng if even else lat
+        mid = (interval[0] + interval[1]) / 2
+        if coordinate >= mid:
+            value = value * 2 + 1
+            interval[0] = mid
+        else:
+            value = value * 2
+            interval[1] = mid
+        even = not even
+
+        bit += 1
+        if bit == 5:
+            chars.append(BASE32[value])
+            bit = 0
+            value = 0
+
+    return "".join(chars)
+
+def decode(geohash: str) -> tuple[float, float, float, float]:
+    # returns the cell as (min_lat, min_lng, max_lat, max_lng)
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    even = True
+
+    for char in geohash:
+        value = BASE32.index(char)
+        for shift in range(4, -1, -1):
+            interval = lng_range if even else lat_range
+            mid = (interval[0] + interval[1]) / 2
+            if (value >> shift) & 1:
+                interval[0] = mid
+            else:
+                interval[1] = mid
+            even = not even
+
+    return lat_range[0], lng_range[0], lat_range[1], lng_range[1]
+
+def cell_size(precision: int) -> tuple[float, float]:
+    lng_bits = math.ceil(precision * 5 / 2)
+    lat_bits = precision * 5 // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lng_bits
+
+def cells_covering(min_lat: float, min_lng: float, max_lat: float, max_lng: float, precision: int) -> set[str]:
+    lat_step, lng_step = cell_size(precision)
+    cells = set()
+
+    lat = min_lat
+    while True:
+        lng = min_lng
+        while True:
+            cells.add(encode(lat, lng, precision))
+            if lng >= max_lng:
+                break
+            lng = min(lng + lng_step, max_lng)
+        if lat >= max_lat:
+            break
+        lat = min(lat + lat_step, max_lat)
+
+    return cells
+
+def covering_cells(min_lat: float, min_lng: float, max_lat: float, max_lng: float, max_cells: int = 16) -> set[str]:
+    # the finest precision whose cells cover the box in at most max_cells range queries
+    for precision in range(9, 0, -1):
+        lat_step, lng_step = cell_size(precision)
+        estimate = (math.ceil((max_lat - min_lat) / lat_step) + 1) * (math.ceil((max_lng - min_lng) / lng_step) + 1)
+        if estimate > max_cells * 4:
+            continue
+
+        cells = cells_covering(min_lat, min_lng, max_lat, max_lng, precision)
+        if len(cells) <= max_cells:
+            return cells
+
+    return set(BASE32)
+
+def bounding_box(lat: float, lng: float, radius_km: float) -> tuple[float, float, float, float]:
+    lat_delta = radius_km / 111.32
+    lng_delta = radius_km / max(111.32 * math.cos(math.radians(lat)), 1e-6)
+    return max(lat - lat_delta, -90.0), max(lng - lng_delta, -180.0), min(lat + lat_delta, 90.0), min(lng + lng_delta, 180.0)
+
+def distance_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 6371.0 * 2 * math.asin(math.sqrt(a))
+
+def zoom_precision(zoom: int) -> int:
+    # roughly one cell per map tile at the given web-map zoom level
+    return max(1, min(9, (zoom + 2) // 2))
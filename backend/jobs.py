@@ -0,0 +1,227 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Union
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", "jobs.db")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 4))
+JOB_QUEUE_MAX = int(os.getenv("JOB_QUEUE_MAX", 256))
+JOB_RETENTION = float(os.getenv("JOB_RETENTION", 7 * 24 * 60 * 60))
+JOB_SWEEP_INTERVAL = float(os.getenv("JOB_SWEEP_INTERVAL", 60 * 60))
+# every process sharing jobs.db renews the lease on its jobs, a job whose lease ran out lost its process
+JOB_HEARTBEAT = float(os.getenv("JOB_HEARTBEAT", 10))
+JOB_LEASE = float(os.getenv("JOB_LEASE", 60))
+
+StageReporter = Callable[[str], Awaitable[None]]
+JobHandler = Callable[[bytes, dict, StageReporter], Awaitable[dict]]
+
+class JobStore:
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            # several uvicorn workers write to the same file
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    stage TEXT NOT NULL,
+                    input BLOB,
+                    params TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    owner TEXT,
+                    heartbeat REAL
+                )
+            """)
+            columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+            for column, kind in (("owner", "TEXT"), ("heartbeat", "REAL")):
+                if column not in columns:
+                    self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+
+    def create(self, kind: str, data: bytes, params: dict, owner: str) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO jobs (id, kind, status, stage, input, params, created_at, updated_at, owner, heartbeat) "
+                "VALUES (?, ?, 'queued', 'queued', ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, data, json.dumps(params), now, now, owner, now)
+            )
+        return job_id
+
+    def update(self, job_id: str, owner: str, **fields) -> bool:
+        # only the lease holder writes, a process that lost the job to another one is ignored
+        if "result" in fields:
+            fields["result"] = json.dumps(fields["result"])
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{column} = ?" for column in fields)
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                f"UPDATE jobs SET {columns} WHERE id = ? AND owner = ?", (*fields.values(), job_id, owner)
+            )
+        return cursor.rowcount == 1
+
+    def get(self, job_id: str) -> Union[dict, None]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def renew(self, owner: str):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET heartbeat = ? WHERE owner = ? AND status IN ('queued', 'running')", (time.time(), owner)
+            )
+
+    def claim_expired(self, owner: str, lease: float) -> list[str]:
+        # takes over unfinished jobs whose process stopped renewing them, jobs of live processes are left alone
+        now = time.time()
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                "UPDATE jobs SET owner = ?, heartbeat = ?, status = 'queued', stage = 'queued', updated_at = ? "
+                "WHERE status IN ('queued', 'running') AND (owner IS NULL OR heartbeat IS NULL OR heartbeat < ?) "
+                "RETURNING id, created_at",
+                (owner, now, now, now - lease)
+            ).fetchall()
+        return [row["id"] for row in sorted(rows, key=lambda row: row["created_at"])]
+
+    def prune(self, older_than: float) -> int:
+        # finished jobs are only kept around long enough for clients to collect the result
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "DELETE FROM jobs WHERE status IN ('succeeded', 'failed') AND updated_at < ?", (older_than,)
+            )
+        return cursor.rowcount
+
+    def close(self):
+        self._conn.close()
+
+class JobQueue:
+    # sqlite calls run on the threadpool so a slow disk never stalls the event loop; the store is
+    # opened in start() so importing the app doesn't touch the database
+    def __init__(self, path: str, workers: int, max_depth: int = JOB_QUEUE_MAX):
+        self.path = path
+        self.store: Union[JobStore, None] = None
+        self.owner = uuid.uuid4().hex
+        self.workers = workers
+        self.max_depth = max_depth
+        self.handlers: dict[str, JobHandler] = {}
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._tasks: list[asyncio.Task] = []
+
+    def register(self, kind: str, handler: JobHandler):
+        self.handlers[kind] = handler
+
+    async def start(self):
+        self.store = await run_in_threadpool(JobStore, self.path)
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._heartbeat()))
+        self._tasks.append(asyncio.create_task(self._sweep()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+
+    async def submit(self, kind: str, data: bytes, params: Union[dict, None] = None) -> str:
+        if kind not in self.handlers:
+            raise ValueError(f"No handler registered for job kind: {kind}")
+        if self.depth() >= self.max_depth:
+            raise HTTPException(status_code=503, detail="The job queue is full, try again later.")
+
+        job_id = await run_in_threadpool(self.store.create, kind, data, params or {}, self.owner)
+        self._queue.put_nowait(job_id)
+        return job_id
+
+    async def get(self, job_id: str) -> Union[dict, None]:
+        return await run_in_threadpool(self.store.get, job_id)
+
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    async def _heartbeat(self):
+        # also picks up the jobs of processes that died, whether before this one started or since
+        while True:
+            try:
+                await run_in_threadpool(self.store.renew, self.owner)
+                for job_id in await run_in_threadpool(self.store.claim_expired, self.owner, JOB_LEASE):
+                    self._queue.put_nowait(job_id)
+            except sqlite3.Error as e:
+                print(f"Job heartbeat failed: {e!r}")
+            await asyncio.sleep(JOB_HEARTBEAT)
+
+    async def _sweep(self):
+        while True:
+            try:
+                pruned = await run_in_threadpool(self.store.prune, time.time() - JOB_RETENTION)
+                if pruned:
+                    print(f"Pruned {pruned} finished jobs")
+            except sqlite3.Error as e:
+                print(f"Job sweep failed: {e!r}")
+            await asyncio.sleep(JOB_SWEEP_INTERVAL)
+
+    async def _work(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            finally:
+                self._queue.task_done()
+
+    async def _update(self, job_id: str, **fields) -> bool:
+        return await run_in_threadpool(self.store.update, job_id, self.owner, **fields)
+
+    async def _run(self, job_id: str):
+        job = await self.get(job_id)
+        if job is None:
+            return
+
+        async def report_stage(stage: str):
+            await self._update(job_id, stage=stage)
+
+        if not await self._update(job_id, status="running"):
+            return
+        try:
+            result = await self.handlers[job["kind"]](job["input"], job["params"], report_stage)
+        except asyncio.CancelledError:
+            # shutting down, the job stays "running" and is picked up again on the next start
+            raise
+        except HTTPException as e:
+            await self._update(job_id, status="failed", stage="failed", error=str(e.detail), input=None)
+        except Exception as e:
+            await self._update(job_id, status="failed", stage="failed", error=str(e), input=None)
+        else:
+            await self._update(job_id, status="succeeded", stage="done", result=result, input=None)
+
+def job_view(job: dict) -> dict[str, Any]:
+    return {
+        "job_id": job["id"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "stage": job["stage"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+        **(job["result"] or {})
+    }
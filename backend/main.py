@@ -1,22 +1,58 @@
-from collections import defaultdict
+import asyncio
+from contextlib import asynccontextmanager
 from typing import Union
-from fastapi import FastAPI, HTTPException, UploadFile, File
+from fastapi import BackgroundTasks, FastAPI, HTTPException, Query, UploadFile, File
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import firebase_admin
-from firebase_admin import credentials, auth, db, storage
+from firebase_admin import credentials, auth, db
 from dotenv import load_dotenv
 import os
-from schemas import Book, Geocode, Location, Place, Size, Stamp, Transformation
-import base64
-import requests
-from datetime import datetime, timedelta
+from schemas import Book, Geocode, Location, Size, Stamp, Transformation
+import json
+from datetime import datetime
 from fastapi.encoders import jsonable_encoder
-from recommendation import get_place_names
+import recommendation
+from recommendation import get_attractions_cached, recommendation_cache, recommendation_flight
+from places import lookup_places, place_cache, stream_places
+from attractions import area_center, area_center_cache, find_nearby, store_places
+from pipeline import Quality, description_cache, generate_stamp, generate_stamp_events, generate_stamps, stamp_cache
+from admission import background_work, describe_admission, generate_admission, recommendation_admission
+from signing import blob_path, resolve_url, sign_pages, sign_records, signed_url, signed_url_cache
+from uploads import finish_upload_session, photo_blob_name, photo_exists, start_upload_session, store_photo
+from covers import cover_library_cache, fill_cover, find_cover, get_cover, retry_cover
+from books import create_book_record, list_books
+from stamps import add_stamp, add_stamps, book_exists, keyed_pages, migrate_pages, normalize_pages, page_summary, parse_cursor, read_pages, read_stamp_page, rebuild_geo_index
+from geo import cluster_stamps, stamps_in_box, stamps_near
+from geohash import zoom_precision
+from jobs import JOB_WORKERS, JOBS_DB_PATH, JobQueue, job_view
+import upstream
 
 load_dotenv()
 
-app = FastAPI()
+job_queue = JobQueue(JOBS_DB_PATH, JOB_WORKERS)
+
+# without one configured a pending book has no cover until the background render lands
+PLACEHOLDER_COVER_URL = os.getenv("PLACEHOLDER_COVER_URL") or None
+MAX_STAMP_BATCH = int(os.getenv("MAX_STAMP_BATCH", 100))
+MAX_STAMP_IMAGE_BATCH = int(os.getenv("MAX_STAMP_IMAGE_BATCH", 20))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", 100))
+CLUSTER_BELOW_ZOOM = int(os.getenv("CLUSTER_BELOW_ZOOM", 13))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await upstream.startup()
+    await recommendation.warm_up()
+    tools_refresh = asyncio.create_task(recommendation.refresh_tools_periodically())
+    await job_queue.start()
+    yield
+    await job_queue.stop()
+    tools_refresh.cancel()
+    await upstream.shutdown()
+
+app = FastAPI(lifespan=lifespan)
 
 origins = ["*"]
 
@@ -34,8 +70,6 @@ firebase_admin.initialize_app(cred, {
     'storageBucket': os.getenv("STORAGE_BUCKET")
 })
 
-bucket = storage.bucket()
-
 class UserCreateRequest(BaseModel):
     email: str
     password: str
@@ -51,6 +85,7 @@ class BookCreateRequest(BaseModel):
     city: str
     state: str
     attractions: Union[list[Location], None] = None
+    background_cover: bool = False
 
 class StampCreateRequest(BaseModel):
     uid: str
@@ -63,10 +98,42 @@ class StampCreateRequest(BaseModel):
     stamp_transformation: Transformation
     notes: Union[str, None] = None
 
+class StampBatchCreateRequest(BaseModel):
+    stamps: list[StampCreateRequest]
+
 @app.get("/")
 def read_root():
     return {"Hello": "World"}
 
+@app.get("/metrics")
+def get_metrics():
+    return {
+        "places_cache": place_cache.stats(),
+        "recommendation_cache": recommendation_cache.stats(),
+        "recommendation_single_flight": recommendation_flight.stats(),
+        "description_cache": description_cache.stats(),
+        "stamp_cache": stamp_cache.stats(),
+        "cover_library_cache": cover_library_cache.stats(),
+        "area_center_cache": area_center_cache.stats(),
+        "signed_url_cache": signed_url_cache.stats(),
+        "job_queue_depth": job_queue.depth(),
+        "admission": {
+            controller.name: controller.stats()
+            for controller in (describe_admission, generate_admission, recommendation_admission)
+        },
+        "upstreams": {
+            upstream_policy.name: upstream_policy.stats()
+            for upstream_policy in (
+                upstream.chat_upstream,
+                upstream.chat_stream_upstream,
+                upstream.image_upstream,
+                upstream.places_upstream,
+                recommendation.groq_upstream,
+                recommendation.toolhouse_upstream
+            )
+        }
+    }
+
 @app.post("/auth/create")
 def create_user(user: UserCreateRequest):
     try:
@@ -100,13 +167,13 @@ async def update_account(uid: str, update: UserUpdateRequest):
     updates = {}
     
     if update.profile_photo:
-        updates['profile_photo'] = update.profile_photo
+        updates['profile_photo'] = blob_path(update.profile_photo)
     
     if update.bio:
         updates['bio'] = update.bio
     
     if updates:
-        user_ref.update(updates)
+        await run_in_threadpool(user_ref.update, updates)
     
     return {
         "message": "User updated successfully",
@@ -115,171 +182,207 @@ async def update_account(uid: str, update: UserUpdateRequest):
 @app.post("/upload-photo")
 async def upload_photo(file: UploadFile = File(...)):
     try:
-        blob = bucket.blob(f"{file.filename}")
-        blob.upload_from_file(file.file, content_type=file.content_type)
-        url = blob.generate_signed_url(expiration=datetime.now() + timedelta(days=7))
+        blob_name, uploaded = await run_in_threadpool(store_photo, file.file, file.content_type)
+        url = signed_url(blob_name)
 
-        return {"message": "Photo uploaded successfully", "download_url": url}
+        return {
+            "message": "Photo uploaded successfully" if uploaded else "Photo already uploaded",
+            "download_url": url
+        }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/stampbook/create")
-async def create_book(request: BookCreateRequest):
+@app.post("/uploads")
+async def create_upload_session(
+    content_type: str,
+    sha256: Union[str, None] = Query(default=None, pattern="^[0-9a-fA-F]{64}$"),
+    origin: Union[str, None] = None
+):
     try:
-        url = "https://api.hyperbolic.xyz/v1/image/generation"
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {os.getenv('HYPERBOLIC_API_KEY')}"
-        }
+        if sha256 is not None:
+            blob_name = photo_blob_name(sha256.lower(), content_type)
+            if await run_in_threadpool(photo_exists, blob_name):
+                return {
+                    "message": "Photo already uploaded",
+                    "download_url": signed_url(blob_name)
+                }
 
-        data = {
-            "model_name": "FLUX.1-dev",
-            "prompt": f"make an illustration of {request.city}, {request.state}, include landmarks",
-            "steps": 30,
-            "cfg_scale": 5,
-            "enable_refiner": False,
-            "height": 1024,
-            "width": 1024,
-            "backend": "auto"
+        upload_id, session_url = await run_in_threadpool(start_upload_session, content_type, origin)
+
+        return {
+            "message": "Upload session created",
+            "upload_id": upload_id,
+            "session_url": session_url
         }
-        
-        try:
-            response = requests.post(url, headers=headers, json=data)
-            response.raise_for_status()
-            image_data = base64.b64decode(response.json().get('images', [{}])[0].get('image', ''))
-            if not image_data:
-                raise HTTPException(status_code=500, detail="Failed to retrieve image data from the API.")
-        except requests.exceptions.RequestException as e:
-            raise HTTPException(status_code=500, detail=f"Error with the API call for image generation: {str(e)}")
-        except KeyError:
-            raise HTTPException(status_code=500, detail="Unexpected response structure from the API when generating image.")
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Error decoding image data: {str(e)}")
-        
-        blob = bucket.blob(f"ai_generated_image_{datetime.now().strftime('%Y%m%d_%H%M%S')}.png")
-        blob.upload_from_string(image_data, content_type='image/png')
-        url = blob.generate_signed_url(expiration=datetime.now() + timedelta(days=7))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/uploads/{upload_id}/complete")
+async def complete_upload_session(upload_id: str):
+    try:
+        finished = await run_in_threadpool(finish_upload_session, upload_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    if finished is None:
+        raise HTTPException(status_code=404, detail=f"Upload {upload_id} not found")
+
+    blob_name, uploaded = finished
+
+    return {
+        "message": "Photo uploaded successfully" if uploaded else "Photo already uploaded",
+        "download_url": signed_url(blob_name)
+    }
+
+@app.post("/stampbook/create")
+async def create_book(request: BookCreateRequest, background_tasks: BackgroundTasks):
+    try:
+        cover_status = "ready"
+        if request.background_cover:
+            cover = await find_cover(request.city, request.state)
+            if cover is None:
+                cover = PLACEHOLDER_COVER_URL
+                cover_status = "pending"
+        else:
+            cover = await get_cover(request.city, request.state)
 
         pages = None
         if request.attractions:
-            pages = defaultdict(list)
-            for attraction in request.attractions:
-                print(attraction)
-                starts_with = attraction.location_name[0].upper()
-                pages[starts_with].append(
-                    jsonable_encoder(attraction)
-                )
+            pages = keyed_pages([
+                (attraction.location_name, jsonable_encoder(attraction)) for attraction in request.attractions
+            ])
 
         book_data = Book(
-            cover=url,
+            cover=cover,
+            cover_status=cover_status,
             pages=pages,
             city=request.city,
             state=request.state
         )
 
-        ref = db.reference(f"/users/{request.uid}/books").push(jsonable_encoder(book_data))
+        book_id = await run_in_threadpool(create_book_record, request.uid, jsonable_encoder(book_data))
+
+        if cover_status == "pending":
+            background_tasks.add_task(fill_cover, request.uid, book_id, request.city, request.state)
 
         return {
             "message": "Book created successfully",
-            "book_id": ref.key,
-            "book_data": jsonable_encoder(book_data)
+            "book_id": book_id,
+            "book_data": (await run_in_threadpool(sign_records, [jsonable_encoder(book_data)], ("cover",)))[0]
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/stampbook/generate-stamp-image")
-async def generate_stamp_image(reference_image: UploadFile = File(...)):
+async def generate_stamp_image(
+    reference_image: UploadFile = File(...),
+    force_regenerate: bool = False,
+    quality: Quality = "standard"
+):
     try:
-        # Read and encode the reference image to base64
         file_content = await reference_image.read()
-        base64_img = base64.b64encode(file_content).decode('utf-8')
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error reading the image: {str(e)}")
 
-    api = "https://api.hyperbolic.xyz/v1/chat/completions"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {os.getenv('HYPERBOLIC_API_KEY')}",
-    }
+    url = await generate_stamp(file_content, force_regenerate=force_regenerate, quality=quality)
 
-    payload = {
-        "messages": [
-            {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": "Describe this image to someone who would draw it without the reference image. Make sure to be detailed."},
-                    {
-                        "type": "image_url",
-                        "image_url": {"url": f"data:image/jpeg;base64,{base64_img}"},
-                    },
-                ],
-            }
-        ],
-        "model": "meta-llama/Llama-3.2-90B-Vision-Instruct",
-        "max_tokens": 2048,
-        "temperature": 0.7,
-        "top_p": 0.9,
+    response = {
+        'message': 'Stamp successfully generated',
+        'image_url': url
     }
-
+    return (await run_in_threadpool(sign_records, [response], ("image_url",)))[0]
+
+@app.post("/stampbook/generate-stamp-image/stream")
+async def generate_stamp_image_stream(
+    reference_image: UploadFile = File(...),
+    force_regenerate: bool = False,
+    quality: Quality = "standard",
+    progressive: bool = False
+):
     try:
-        response = requests.post(api, headers=headers, json=payload)
-        response.raise_for_status()
-        description = response.json().get('choices', [{}])[0].get('message', {}).get('content', '')
-        if not description:
-            raise HTTPException(status_code=500, detail="Failed to retrieve description from API.")
-    except requests.exceptions.RequestException as e:
-        raise HTTPException(status_code=500, detail=f"Error with the API call for description: {str(e)}")
-    except KeyError:
-        raise HTTPException(status_code=500, detail="Unexpected response structure from the API when fetching description.")
-
-    # Draw reference image
-    url = "https://api.hyperbolic.xyz/v1/image/generation"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {os.getenv('HYPERBOLIC_API_KEY')}"
-    }
+        file_content = await reference_image.read()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error reading the image: {str(e)}")
+
+    # Starlette cancels this generator when the client disconnects, which also aborts the upstream calls
+    async def events():
+        async for event, data in generate_stamp_events(file_content, force_regenerate, quality, progressive):
+            yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.post("/stampbook/generate-stamp-images")
+async def generate_stamp_images(
+    reference_images: list[UploadFile] = File(...),
+    force_regenerate: bool = False,
+    quality: Quality = "standard"
+):
+    if len(reference_images) > MAX_STAMP_IMAGE_BATCH:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_STAMP_IMAGE_BATCH} images can be generated per request.")
+
+    # the batch is admitted once here, its photos then wait for generate slots however long that takes
+    generate_admission.check()
 
-    data = {
-        "model_name": "FLUX.1-dev",
-        "prompt": "Using this description, generate a fun sticker: " + description,
-        "steps": 30,
-        "cfg_scale": 5,
-        "enable_refiner": False,
-        "height": 1024,
-        "width": 1024,
-        "backend": "auto"
-    }
-    
     try:
-        response = requests.post(url, headers=headers, json=data)
-        response.raise_for_status()
-        image_data = base64.b64decode(response.json().get('images', [{}])[0].get('image', ''))
-        if not image_data:
-            raise HTTPException(status_code=500, detail="Failed to retrieve image data from the API.")
-    except requests.exceptions.RequestException as e:
-        raise HTTPException(status_code=500, detail=f"Error with the API call for image generation: {str(e)}")
-    except KeyError:
-        raise HTTPException(status_code=500, detail="Unexpected response structure from the API when generating image.")
+        photos = [await reference_image.read() for reference_image in reference_images]
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error decoding image data: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error reading the image: {str(e)}")
 
+    async def results():
+        async for index, url, error in generate_stamps(photos, force_regenerate, quality):
+            result = {"index": index, "filename": reference_images[index].filename}
+            if error is None:
+                result["image_url"] = url
+            else:
+                result["error"] = error
+            yield json.dumps(result) + "\n"
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+async def run_stamp_job(file_content: bytes, params: dict, report_stage):
+    with background_work():
+        url = await generate_stamp(
+            file_content,
+            on_stage=report_stage,
+            force_regenerate=params.get("force_regenerate", False),
+            quality=params.get("quality", "standard")
+        )
+    return {'image_url': url}
+
+job_queue.register("generate-stamp-image", run_stamp_job)
+
+@app.post("/jobs/generate-stamp-image", status_code=202)
+async def submit_stamp_job(
+    reference_image: UploadFile = File(...),
+    force_regenerate: bool = False,
+    quality: Quality = "standard"
+):
     try:
-        blob = bucket.blob(f"ai_generated_image_{datetime.now().strftime('%Y%m%d_%H%M%S')}.png")
-        blob.upload_from_string(image_data, content_type='image/png')
-        url = blob.generate_signed_url(expiration=datetime.now() + timedelta(days=7))
+        file_content = await reference_image.read()
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error uploading image to storage: {str(e)}")
-    
+        raise HTTPException(status_code=500, detail=f"Error reading the image: {str(e)}")
+
+    job_id = await job_queue.submit("generate-stamp-image", file_content, {"force_regenerate": force_regenerate, "quality": quality})
+
     return {
-        'message': 'Stamp successfully generated',
-        'image_url': url
+        'message': 'Stamp generation queued',
+        'job_id': job_id
     }
 
-@app.post("/stampbook/create-stamp")
-async def create_stamp(request: StampCreateRequest):
-    stamp_data = Stamp(
-        photo_url=request.photo_url,
-        stamp_url=request.stamp_url,
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+
+    return (await run_in_threadpool(sign_records, [job_view(job)], ("image_url",)))[0]
+
+def build_stamp(request: StampCreateRequest) -> Stamp:
+    return Stamp(
+        photo_url=blob_path(request.photo_url),
+        stamp_url=blob_path(request.stamp_url),
         stamp_size=request.stamp_size,
         stamp_transformation=request.stamp_transformation,
         date=datetime.now().strftime("%m/%d/%Y"),
@@ -288,106 +391,141 @@ async def create_stamp(request: StampCreateRequest):
         geocode=request.geocode
     )
 
-    ref = db.reference(f"/users/{request.uid}/books/{request.bookid}/pages")
-    pages = ref.get()
+@app.post("/stampbook/create-stamp")
+async def create_stamp(request: StampCreateRequest):
+    stamp_data = build_stamp(request)
 
-    if pages is None:
-        pages = defaultdict(list)
-    
-    first_letter = request.location_name[0].upper()
-    pages[first_letter].append(jsonable_encoder(stamp_data))
+    stamp_id = await run_in_threadpool(add_stamp, request.uid, request.bookid, jsonable_encoder(stamp_data))
 
-    ref.set(pages)
-    
     return {
         "message": "Stamp created successfully",
-        "stamp_data": jsonable_encoder(stamp_data)
+        "stamp_id": stamp_id,
+        "stamp_data": (await run_in_threadpool(sign_records, [jsonable_encoder(stamp_data)]))[0]
     }
 
-@app.get("/travel/rec")
-async def travel_rec(city: str, state: str, query: Union[str, None] = None):
+@app.post("/stampbook/create-stamps")
+async def create_stamps(request: StampBatchCreateRequest):
+    if len(request.stamps) > MAX_STAMP_BATCH:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_STAMP_BATCH} stamps can be created per request.")
+
     try:
-        place_names = get_place_names(f"{city}, {state}", query)
-        
-        output = {
-            'places': []
+        books = list({(stamp.uid, stamp.bookid) for stamp in request.stamps})
+        exists = await asyncio.gather(*(run_in_threadpool(book_exists, uid, book_id) for uid, book_id in books))
+        existing_books = {book for book, found in zip(books, exists) if found}
+
+        results = []
+        valid = []
+        for index, stamp in enumerate(request.stamps):
+            if not stamp.location_name.strip():
+                results.append({"index": index, "status": "invalid", "detail": "location_name must not be empty"})
+            elif (stamp.uid, stamp.bookid) not in existing_books:
+                results.append({"index": index, "status": "invalid", "detail": f"Stampbook {stamp.bookid} not found"})
+            else:
+                stamp_data = jsonable_encoder(build_stamp(stamp))
+                results.append({"index": index, "status": "created", "stamp_data": stamp_data})
+                valid.append((stamp.uid, stamp.bookid, stamp_data))
+
+        if valid:
+            stamp_ids = iter(await run_in_threadpool(add_stamps, valid))
+            for result in results:
+                if result["status"] == "created":
+                    result["stamp_id"] = next(stamp_ids)
+
+            created = [result for result in results if result["status"] == "created"]
+            signed = await run_in_threadpool(sign_records, [result["stamp_data"] for result in created])
+            for result, stamp_data in zip(created, signed):
+                result["stamp_data"] = stamp_data
+
+        return {
+            "message": f"Created {len(valid)} of {len(request.stamps)} stamps",
+            "results": results
         }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        print(place_names)
+@app.get("/travel/rec")
+async def travel_rec(
+    city: str,
+    state: str,
+    background_tasks: BackgroundTasks,
+    query: Union[str, None] = None,
+    stream: bool = False,
+    lat: Union[float, None] = None,
+    lng: Union[float, None] = None
+):
+    try:
+        center = await area_center(city, state, lat, lng)
+        if center is not None:
+            nearby = await run_in_threadpool(find_nearby, center, query)
+            if nearby is not None:
+                if stream:
+                    return StreamingResponse(
+                        (json.dumps(jsonable_encoder(place)) + "\n" for place in nearby),
+                        media_type="application/x-ndjson"
+                    )
 
-        for name in place_names:
-            url = "https://places.googleapis.com/v1/places:searchText"
-            headers = {
-                "X-Goog-Api-Key": os.getenv('GOOGLE_API_KEY'),
-                "X-Goog-FieldMask": "places.displayName,places.googleMapsUri,places.location,places.formattedAddress,places.rating,places.photos"
-            }
-            data = {
-                "textQuery": f"{name} {city}, {state}",
-            }
+                return {
+                    'places': [jsonable_encoder(place) for place in nearby]
+                }
 
-            response = requests.post(url, headers=headers, json=data)
-            data = response.json()
-            print(data)
-
-            if response.status_code == 200:
-                places = data.get('places', [])
-                if places:
-                    place_data = places[0]
-                    
-                    display_name = place_data.get('displayName', {}).get('text', "")
-                    google_maps_uri = place_data.get('googleMapsUri', "")
-                    lat = place_data.get('location', {}).get('latitude', -1)
-                    lng = place_data.get('location', {}).get('longitude', -1)
-                    formatted_address = place_data.get('formattedAddress', "")
-                    rating = place_data.get('rating', 0)
-                    photo_uri = ""
-                    
-                    if 'photos' in place_data and place_data['photos']:
-                        author_attributions = place_data['photos'][0].get('authorAttributions', [])
-                        if author_attributions:
-                            photo_uri = author_attributions[0].get('uri', "")
-
-                    if display_name and google_maps_uri and lat is not None and lng is not None:
-                        output['places'].append(jsonable_encoder(
-                            Place(
-                                display_name=display_name,
-                                google_maps_uri=google_maps_uri,
-                                geocode=Geocode(lat=lat, lng=lng),
-                                formatted_address=formatted_address,
-                                rating=rating,
-                                photo_uri=photo_uri
-                            )
-                        ))
-            else:
-                continue
-        
-        return output
+        attractions = await get_attractions_cached(f"{city}, {state}", query)
+
+        print(attractions)
+
+        if stream:
+            async def place_lines():
+                places = []
+                async for place in stream_places(attractions, city, state):
+                    places.append(place)
+                    yield json.dumps(jsonable_encoder(place)) + "\n"
+
+                await run_in_threadpool(store_places, places, query)
+
+            return StreamingResponse(place_lines(), media_type="application/x-ndjson")
+
+        places = await lookup_places(attractions, city, state)
+        background_tasks.add_task(store_places, places, query)
+
+        return {
+            'places': [jsonable_encoder(place) for place in places]
+        }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get('/stampbook')
-async def get_stampbooks(uid: str):
+async def get_stampbooks(uid: str, background_tasks: BackgroundTasks):
     try:
-        ref = db.reference(f"/users/{uid}/books")
-
-        books = ref.get()
+        books = await run_in_threadpool(list_books, uid)
 
         if books is None:
             print('No books found.')
             return
-        
-        stampbook_data = {
-            'stampbooks': []
-        }
 
+        stampbooks = []
         for book_id, book_info in books.items():
-            stampbook_data['stampbooks'].append({
+            cover_status = book_info.get('cover_status')
+            if cover_status == "failed":
+                background_tasks.add_task(retry_cover, uid, book_id, book_info['city'], book_info['state'])
+                cover_status = "pending"
+
+            # a pending book without a placeholder has no cover, RTDB drops the null field
+            stampbooks.append({
                 'book_id': book_id,
                 'city': book_info['city'],
                 'state': book_info['state'],
-                'cover': book_info['cover']
+                'cover': book_info.get('cover'),
+                'cover_status': cover_status,
+                'stamp_count': book_info.get('stamp_count', 0),
+                'last_updated': book_info.get('last_updated')
             })
-        
+
+        # every cover of the listing is signed in one batch
+        stampbook_data = {
+            'stampbooks': await run_in_threadpool(sign_records, stampbooks, ("cover",))
+        }
+
         return {
             'message': f'Stampbooks for user: {uid}',
             'stampbook_data': stampbook_data
@@ -397,17 +535,135 @@ async def get_stampbooks(uid: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get('/stampbook/{book_id}')
-async def get_book_pages(uid: str, book_id: str):
+async def get_book_pages(
+    uid: str,
+    book_id: str,
+    start_letter: Union[str, None] = None,
+    end_letter: Union[str, None] = None,
+    limit: Union[int, None] = Query(default=None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Union[str, None] = None,
+    summary: bool = False
+):
+    if cursor is not None and parse_cursor(cursor) is None:
+        raise HTTPException(status_code=400, detail="Malformed cursor, expected the next_cursor of a previous page.")
+
     try:
-        ref = db.reference(f"/users/{uid}/books/{book_id}/pages")
+        if summary:
+            page_counts = await run_in_threadpool(page_summary, uid, book_id)
+
+            return {
+                'message': f'Page summary of stampbook {book_id} for user: {uid}',
+                'page_summary': page_counts
+            }
+
+        if limit is not None or cursor is not None:
+            stampbook_pages, next_cursor = await run_in_threadpool(
+                read_stamp_page, uid, book_id, limit or MAX_PAGE_SIZE, cursor, start_letter, end_letter
+            )
+
+            return {
+                'message': f'Stampbook {book_id} for user: {uid}',
+                'stampbook_pages': await run_in_threadpool(sign_pages, stampbook_pages),
+                'next_cursor': next_cursor
+            }
+
+        stampbook_pages = normalize_pages(await run_in_threadpool(read_pages, uid, book_id, start_letter, end_letter))
 
-        stampbook_pages = ref.get()
-        
         return {
             'message': f'Stampbook {book_id} for user: {uid}',
-            'stampbook_pages': stampbook_pages
+            'stampbook_pages': await run_in_threadpool(sign_pages, stampbook_pages)
         }
-    
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post('/stampbook/{book_id}/migrate')
+async def migrate_book_pages(uid: str, book_id: str):
+    try:
+        migrated = await run_in_threadpool(migrate_pages, uid, book_id)
+
+        return {
+            'message': f'Migrated stampbook {book_id} to keyed pages',
+            'migrated_stamps': migrated
+        }
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get('/stampbook/{book_id}/cover')
+async def get_book_cover(uid: str, book_id: str, background_tasks: BackgroundTasks):
+    try:
+        book = await run_in_threadpool(db.reference(f"/users/{uid}/books/{book_id}").get)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    if book is None:
+        raise HTTPException(status_code=404, detail=f"Stampbook {book_id} not found")
+
+    cover_status = book.get("cover_status") or "ready"
+    if cover_status == "failed":
+        background_tasks.add_task(retry_cover, uid, book_id, book["city"], book["state"])
+        cover_status = "pending"
+
+    try:
+        return {
+            'message': f'Cover for stampbook {book_id}',
+            'cover': await run_in_threadpool(resolve_url, book.get("cover")),
+            'cover_status': cover_status
+        }
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get('/stamps/nearby')
+async def get_nearby_stamps(
+    uid: str,
+    min_lat: Union[float, None] = None,
+    min_lng: Union[float, None] = None,
+    max_lat: Union[float, None] = None,
+    max_lng: Union[float, None] = None,
+    lat: Union[float, None] = None,
+    lng: Union[float, None] = None,
+    radius_km: Union[float, None] = Query(default=None, gt=0),
+    zoom: Union[int, None] = Query(default=None, ge=0, le=22)
+):
+    if None not in (min_lat, min_lng, max_lat, max_lng):
+        if min_lat > max_lat or min_lng > max_lng:
+            raise HTTPException(status_code=400, detail="Bounding box minimums must not exceed its maximums.")
+        query = (stamps_in_box, uid, min_lat, min_lng, max_lat, max_lng)
+    elif None not in (lat, lng, radius_km):
+        query = (stamps_near, uid, lat, lng, radius_km)
+    else:
+        raise HTTPException(status_code=400, detail="Provide either min_lat, min_lng, max_lat and max_lng, or lat, lng and radius_km.")
+
+    try:
+        stamps = await run_in_threadpool(*query)
+        stamps = await run_in_threadpool(sign_records, stamps, ("stamp_url",))
+
+        if zoom is not None and zoom < CLUSTER_BELOW_ZOOM:
+            return {
+                'message': f'Clustered stamps for user: {uid}',
+                'clusters': cluster_stamps(stamps, zoom_precision(zoom))
+            }
+
+        return {
+            'message': f'Stamps for user: {uid}',
+            'stamps': stamps
+        }
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post('/stamps/reindex')
+async def reindex_stamps(uid: str):
+    try:
+        indexed = await run_in_threadpool(rebuild_geo_index, uid)
+
+        return {
+            'message': f'Rebuilt stamp location index for user: {uid}',
+            'indexed_stamps': indexed
+        }
+
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -416,8 +672,18 @@ async def get_account(uid: str):
     try:
         ref = db.reference(f"/users/{uid}")
 
-        user_info = ref.get()
-        
+        user_info = await run_in_threadpool(ref.get)
+
+        if user_info:
+            user_info['profile_photo'] = await run_in_threadpool(resolve_url, user_info.get('profile_photo'))
+
+        if user_info and user_info.get('books'):
+            books = user_info['books']
+            signed = await run_in_threadpool(sign_records, list(books.values()), ("cover",))
+            for book_id, book_info in zip(books, signed):
+                book_info['pages'] = await run_in_threadpool(sign_pages, normalize_pages(book_info.get('pages')))
+                books[book_id] = book_info
+
         return {
             'message': f'Retrieved information for user: {uid}',
             'user_info': user_info
@@ -0,0 +1,312 @@
+import asyncio
+import base64
+import hashlib
+import os
+import uuid
+from datetime import datetime
+from typing import AsyncIterator, Awaitable, Callable, Literal, Union
+import httpx
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from firebase_admin import storage
+from admission import background_work, describe_admission, generate_admission
+from cache import MISSING, SingleFlight, TTLCache
+from preprocess import prepare_photo
+from renditions import encode_renditions, rendition_path
+from signing import signed_url
+import upstream
+
+VISION_MODEL = "meta-llama/Llama-3.2-90B-Vision-Instruct"
+IMAGE_MODEL = "FLUX.1-dev"
+
+DESCRIBE_PROMPT = "Describe this image to someone who would draw it without the reference image. Make sure to be detailed."
+STAMP_PROMPT = "Using this description, generate a fun sticker: "
+
+StageCallback = Callable[[str], Awaitable[None]]
+
+Quality = Literal["preview", "standard", "high"]
+
+# preview renders in a few seconds for editor feedback, standard matches what every stamp used to get
+QUALITY_TIERS = {
+    "preview": {"steps": 8, "size": 512},
+    "standard": {"steps": 30, "size": 1024},
+    "high": {"steps": 50, "size": 1024}
+}
+
+# keyed by the sha256 of the uploaded photo
+description_cache = TTLCache(
+    maxsize=int(os.getenv("DESCRIPTION_CACHE_SIZE", 5000)),
+    ttl=float(os.getenv("DESCRIPTION_CACHE_TTL", 7 * 24 * 60 * 60))
+)
+stamp_cache = TTLCache(
+    maxsize=int(os.getenv("STAMP_CACHE_SIZE", 5000)),
+    ttl=float(os.getenv("STAMP_CACHE_TTL", 7 * 24 * 60 * 60))
+)
+stamp_flight = SingleFlight()
+
+upload_slots = asyncio.Semaphore(int(os.getenv("UPLOAD_CONCURRENCY", 8)))
+
+def content_hash(file_content: bytes) -> str:
+    return hashlib.sha256(file_content).hexdigest()
+
+def description_payload(image_data: bytes, media_type: str) -> dict:
+    base64_img = base64.b64encode(image_data).decode('utf-8')
+
+    return {
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": DESCRIBE_PROMPT},
+                    {
+                        "type": "image_url",
+                        "image_url": {"url": f"data:{media_type};base64,{base64_img}"},
+                    },
+                ],
+            }
+        ],
+        "model": VISION_MODEL,
+        "max_tokens": 2048,
+        "temperature": 0.7,
+        "top_p": 0.9,
+    }
+
+def image_payload(prompt: str, quality: Quality = "standard") -> dict:
+    tier = QUALITY_TIERS[quality]
+    return {
+        "model_name": IMAGE_MODEL,
+        "prompt": prompt,
+        "steps": tier["steps"],
+        "cfg_scale": 5,
+        "enable_refiner": False,
+        "height": tier["size"],
+        "width": tier["size"],
+        "backend": "auto"
+    }
+
+async def describe_image(file_content: bytes) -> str:
+    try:
+        async with describe_admission.slot():
+            image_data, media_type = await run_in_threadpool(prepare_photo, file_content)
+            response = await upstream.chat_completion(description_payload(image_data, media_type))
+        description = response.get('choices', [{}])[0].get('message', {}).get('content', '')
+        if not description:
+            raise HTTPException(status_code=500, detail="Failed to retrieve description from API.")
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=500, detail=f"Error with the API call for description: {str(e)}")
+    except KeyError:
+        raise HTTPException(status_code=500, detail="Unexpected response structure from the API when fetching description.")
+
+    return description
+
+async def describe_image_stream(file_content: bytes) -> AsyncIterator[str]:
+    received = False
+    try:
+        async with describe_admission.slot():
+            image_data, media_type = await run_in_threadpool(prepare_photo, file_content)
+            async for token in upstream.chat_completion_stream(description_payload(image_data, media_type)):
+                received = True
+                yield token
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=500, detail=f"Error with the API call for description: {str(e)}")
+    except (KeyError, IndexError, ValueError):
+        raise HTTPException(status_code=500, detail="Unexpected response structure from the API when fetching description.")
+
+    if not received:
+        raise HTTPException(status_code=500, detail="Failed to retrieve description from API.")
+
+async def generate_image(prompt: str, quality: Quality = "standard") -> bytes:
+    try:
+        async with generate_admission.slot():
+            response = await upstream.image_generation(image_payload(prompt, quality))
+        image_data = base64.b64decode(response.get('images', [{}])[0].get('image', ''))
+        if not image_data:
+            raise HTTPException(status_code=500, detail="Failed to retrieve image data from the API.")
+    except HTTPException:
+        raise
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=500, detail=f"Error with the API call for image generation: {str(e)}")
+    except KeyError:
+        raise HTTPException(status_code=500, detail="Unexpected response structure from the API when generating image.")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error decoding image data: {str(e)}")
+
+    return image_data
+
+async def upload_image(image_data: bytes, base_name: Union[str, None] = None) -> str:
+    # uploads the WebP renditions under base_name and returns the blob path of the full one
+    try:
+        if base_name is None:
+            base_name = f"ai_generated_image_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        renditions = await run_in_threadpool(encode_renditions, image_data)
+        bucket = storage.bucket()
+        async with upload_slots:
+            await asyncio.gather(*(
+                run_in_threadpool(
+                    bucket.blob(rendition_path(base_name, rendition)).upload_from_string, data, content_type='image/webp'
+                )
+                for rendition, data in renditions.items()
+            ))
+        return rendition_path(base_name, "full")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error uploading image to storage: {str(e)}")
+
+def stamp_key(photo_hash: str, quality: Quality) -> str:
+    return photo_hash if quality == "standard" else f"{photo_hash}_{quality}"
+
+def stamp_base_name(photo_hash: str, force_regenerate: bool, quality: Quality = "standard") -> str:
+    # a forced render gets its own blobs so stamps already pointing at the old ones keep their image
+    if force_regenerate:
+        return f"stamps/{stamp_key(photo_hash, quality)}_{uuid.uuid4().hex[:8]}"
+    return f"stamps/{stamp_key(photo_hash, quality)}"
+
+def blob_exists(blob_name: str) -> bool:
+    return storage.bucket().blob(blob_name).exists()
+
+async def stored_stamp(photo_hash: str, quality: Quality) -> Union[str, None]:
+    # stamp_cache only lives as long as the process, storage still has renders from before a restart
+    key = stamp_key(photo_hash, quality)
+    blob_name = stamp_cache.get(key)
+    if blob_name is not MISSING:
+        return blob_name
+
+    blob_name = rendition_path(stamp_base_name(photo_hash, False, quality), "full")
+    if not await run_in_threadpool(blob_exists, blob_name):
+        return None
+
+    stamp_cache.set(key, blob_name)
+    return blob_name
+
+async def render_stamp(description: str, photo_hash: str, force_regenerate: bool, quality: Quality) -> str:
+    if not force_regenerate:
+        blob_name = await stored_stamp(photo_hash, quality)
+        if blob_name is not None:
+            return blob_name
+
+    image_data = await generate_image(STAMP_PROMPT + description, quality)
+    blob_name = await upload_image(image_data, stamp_base_name(photo_hash, force_regenerate, quality))
+    stamp_cache.set(stamp_key(photo_hash, quality), blob_name)
+    return blob_name
+
+async def cached_description(file_content: bytes, photo_hash: str, force_regenerate: bool) -> str:
+    if not force_regenerate:
+        description = description_cache.get(photo_hash)
+        if description is not MISSING:
+            return description
+
+    description = await describe_image(file_content)
+    description_cache.set(photo_hash, description)
+    return description
+
+async def generate_stamp(
+    file_content: bytes,
+    on_stage: Union[StageCallback, None] = None,
+    force_regenerate: bool = False,
+    quality: Quality = "standard"
+) -> str:
+    photo_hash = content_hash(file_content)
+    key = stamp_key(photo_hash, quality)
+
+    if not force_regenerate:
+        blob_name = await stored_stamp(photo_hash, quality)
+        if blob_name is not None:
+            return signed_url(blob_name)
+
+    async def stage(name: str):
+        if on_stage is not None:
+            await on_stage(name)
+
+    async def render():
+        # turned away before spending a description on a photo that couldn't be rendered anyway
+        generate_admission.check()
+
+        await stage("describing")
+        description = await cached_description(file_content, photo_hash, force_regenerate)
+
+        await stage("generating")
+        image_data = await generate_image(STAMP_PROMPT + description, quality)
+
+        await stage("uploading")
+        blob_name = await upload_image(image_data, stamp_base_name(photo_hash, force_regenerate, quality))
+        stamp_cache.set(key, blob_name)
+        return signed_url(blob_name)
+
+    if force_regenerate:
+        return await render()
+
+    # a retry of the same photo while the first attempt is still rendering waits for that render
+    return await stamp_flight.do(key, render)
+
+async def generate_stamps(
+    photos: list[bytes],
+    force_regenerate: bool = False,
+    quality: Quality = "standard"
+) -> AsyncIterator[tuple[int, Union[str, None], Union[str, None]]]:
+    # every photo runs the whole pipeline on its own, the stage slots make the stages overlap across photos;
+    # the batch was admitted as a whole, so its photos queue for slots instead of being turned away one by one
+    async def run(index: int, file_content: bytes):
+        try:
+            with background_work():
+                return index, await generate_stamp(file_content, force_regenerate=force_regenerate, quality=quality), None
+        except HTTPException as e:
+            return index, None, e.detail
+
+    tasks = [asyncio.create_task(run(index, file_content)) for index, file_content in enumerate(photos)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+
+async def generate_stamp_events(
+    file_content: bytes,
+    force_regenerate: bool = False,
+    quality: Quality = "standard",
+    progressive: bool = False
+) -> AsyncIterator[tuple[str, dict]]:
+    photo_hash = content_hash(file_content)
+    render = None
+    try:
+        if not force_regenerate:
+            blob_name = await stored_stamp(photo_hash, quality)
+            if blob_name is not None:
+                yield "done", {"stage": "done", "image_url": signed_url(blob_name), "cached": True}
+                return
+
+        yield "stage", {"stage": "describing"}
+        description = description_cache.get(photo_hash) if not force_regenerate else MISSING
+        if description is not MISSING:
+            yield "description", {"token": description}
+        else:
+            tokens = []
+            async for token in describe_image_stream(file_content):
+                tokens.append(token)
+                yield "description", {"token": token}
+            description = "".join(tokens)
+            description_cache.set(photo_hash, description)
+
+        yield "stage", {"stage": "generating"}
+        if progressive and quality != "preview":
+            # the full render is already running, the preview only gives the editor something to show meanwhile
+            render = asyncio.create_task(render_stamp(description, photo_hash, force_regenerate, quality))
+            try:
+                preview = await render_stamp(description, photo_hash, force_regenerate, "preview")
+                yield "preview", {"stage": "generating", "image_url": signed_url(preview)}
+            except HTTPException as e:
+                print(f"Stamp preview failed: {e.detail}")
+
+            blob_name = await render
+        else:
+            image_data = await generate_image(STAMP_PROMPT + description, quality)
+
+            yield "stage", {"stage": "uploading"}
+            blob_name = await upload_image(image_data, stamp_base_name(photo_hash, force_regenerate, quality))
+            stamp_cache.set(stamp_key(photo_hash, quality), blob_name)
+
+        yield "done", {"stage": "done", "image_url": signed_url(blob_name)}
+    except HTTPException as e:
+        yield "error", {"stage": "failed", "detail": e.detail}
+    finally:
+        if render is not None:
+            render.cancel()
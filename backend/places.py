@@ -0,0 +1,104 @@
+import asyncio
+import os
+import re
+from typing import AsyncIterator, Union
+import httpx
+from cache import MISSING, TTLCache
+from schemas import Attraction, Geocode, Place
+import upstream
+
+PLACES_FIELD_MASK = "places.displayName,places.googleMapsUri,places.location,places.formattedAddress,places.rating,places.photos"
+
+LOOKUP_CONCURRENCY = int(os.getenv("PLACES_LOOKUP_CONCURRENCY", 8))
+LOCATION_BIAS_RADIUS = float(os.getenv("PLACES_LOCATION_BIAS_RADIUS", 5000))
+
+place_cache = TTLCache(
+    maxsize=int(os.getenv("PLACES_CACHE_SIZE", 10000)),
+    ttl=float(os.getenv("PLACES_CACHE_TTL", 24 * 60 * 60))
+)
+PLACES_NEGATIVE_TTL = float(os.getenv("PLACES_NEGATIVE_CACHE_TTL", 15 * 60))
+
+def normalize_query(text_query: str) -> str:
+    return re.sub(r"[\s,]+", " ", text_query.lower()).strip()
+
+def parse_place(place_data: dict) -> Union[Place, None]:
+    display_name = place_data.get('displayName', {}).get('text', "")
+    google_maps_uri = place_data.get('googleMapsUri', "")
+    lat = place_data.get('location', {}).get('latitude', -1)
+    lng = place_data.get('location', {}).get('longitude', -1)
+    formatted_address = place_data.get('formattedAddress', "")
+    rating = place_data.get('rating', 0)
+    photo_uri = ""
+
+    if 'photos' in place_data and place_data['photos']:
+        author_attributions = place_data['photos'][0].get('authorAttributions', [])
+        if author_attributions:
+            photo_uri = author_attributions[0].get('uri', "")
+
+    if display_name and google_maps_uri and lat is not None and lng is not None:
+        return Place(
+            display_name=display_name,
+            google_maps_uri=google_maps_uri,
+            geocode=Geocode(lat=lat, lng=lng),
+            formatted_address=formatted_address,
+            rating=rating,
+            photo_uri=photo_uri
+        )
+
+    return None
+
+def location_bias(geocode: Union[Geocode, None]) -> Union[dict, None]:
+    if geocode is None:
+        return None
+
+    return {
+        "circle": {
+            "center": {"latitude": geocode.lat, "longitude": geocode.lng},
+            "radius": LOCATION_BIAS_RADIUS
+        }
+    }
+
+async def search_place(text_query: str, field_mask: str = PLACES_FIELD_MASK, near: Union[Geocode, None] = None) -> Union[Place, None]:
+    # coordinates are rounded (~1 km) so nearby hints for the same attraction share an entry
+    bias_key = (round(near.lat, 2), round(near.lng, 2)) if near is not None else None
+    key = (normalize_query(text_query), field_mask, bias_key)
+    cached = place_cache.get(key)
+    if cached is not MISSING:
+        return cached
+
+    response = await upstream.search_text(text_query, field_mask, location_bias(near))
+    if response.status_code != 200:
+        # upstream errors are transient, only "no such place" is worth remembering
+        return None
+
+    places = response.json().get('places', [])
+    place = parse_place(places[0]) if places else None
+
+    place_cache.set(key, place, ttl=None if place is not None else PLACES_NEGATIVE_TTL)
+    return place
+
+async def lookup_place(attraction: Attraction, city: str, state: str, semaphore: asyncio.Semaphore) -> Union[Place, None]:
+    # the places upstream's deadline bounds each lookup, so a slow lookup still counts against its breaker
+    async with semaphore:
+        try:
+            return await search_place(f"{attraction.name.strip()} {city}, {state}", near=attraction.geocode)
+        except httpx.HTTPError as e:
+            print(f"Dropping place lookup for {attraction.name}: {e!r}")
+            return None
+
+async def lookup_places(attractions: list[Attraction], city: str, state: str) -> list[Place]:
+    semaphore = asyncio.Semaphore(LOOKUP_CONCURRENCY)
+    results = await asyncio.gather(*(lookup_place(attraction, city, state, semaphore) for attraction in attractions))
+    return [place for place in results if place is not None]
+
+async def stream_places(attractions: list[Attraction], city: str, state: str) -> AsyncIterator[Place]:
+    semaphore = asyncio.Semaphore(LOOKUP_CONCURRENCY)
+    tasks = [asyncio.create_task(lookup_place(attraction, city, state, semaphore)) for attraction in attractions]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            place = await next_done
+            if place is not None:
+                yield place
+    finally:
+        for task in tasks:
+            task.cancel()
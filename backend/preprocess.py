@@ -0,0 +1,55 @@
+import io
+import os
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+try:
+    # HEIC photos straight from iPhones only decode with the optional pillow-heif plugin
+    from pillow_heif import register_heif_opener
+    register_heif_opener()
+except ImportError:
+    pass
+
+# Llama 3.2 Vision tiles images into 560px squares and uses at most 2x2 of them
+VISION_MAX_SIDE = int(os.getenv("VISION_MAX_SIDE", 1120))
+VISION_JPEG_QUALITY = int(os.getenv("VISION_JPEG_QUALITY", 85))
+
+def sniff_media_type(file_content: bytes) -> str:
+    # what the original bytes are, for photos that have to be sent on undecoded
+    if file_content.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if file_content.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if file_content[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if file_content[:4] == b"RIFF" and file_content[8:12] == b"WEBP":
+        return "image/webp"
+    if file_content[4:8] == b"ftyp" and file_content[8:12] in (b"heic", b"heix", b"heim", b"heis", b"mif1", b"msf1"):
+        return "image/heic"
+    if file_content[4:8] == b"ftyp" and file_content[8:12] in (b"avif", b"avis"):
+        return "image/avif"
+    return "application/octet-stream"
+
+def prepare_photo(file_content: bytes) -> tuple[bytes, str]:
+    # returns the image to send to the vision model and its media type
+    try:
+        image = Image.open(io.BytesIO(file_content))
+        # decoding at a reduced scale keeps large JPEGs from being fully decoded just to be shrunk
+        image.draft("RGB", (VISION_MAX_SIDE, VISION_MAX_SIDE))
+        image = ImageOps.exif_transpose(image)
+    except (UnidentifiedImageError, OSError) as e:
+        print(f"Photo preprocessing skipped, could not decode the image: {e}")
+        return file_content, sniff_media_type(file_content)
+
+    if image.mode in ("RGBA", "LA", "P"):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, "white")
+        background.paste(image, mask=image.getchannel("A"))
+        image = background
+    else:
+        image = image.convert("RGB")
+
+    image.thumbnail((VISION_MAX_SIDE, VISION_MAX_SIDE), Image.Resampling.LANCZOS)
+
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=VISION_JPEG_QUALITY, optimize=True)
+    return output.getvalue(), "image/jpeg"
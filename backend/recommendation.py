@@ -1,44 +1,212 @@
+import asyncio
+import json
+import os
+import re
 from typing import Union
+import groq
+import requests
 from groq import Groq
 from toolhouse import Toolhouse
+from admission import groq_bucket, recommendation_admission
+from cache import MISSING, SingleFlight, TTLCache
+from resilience import RETRY_STATUSES, CircuitBreaker, Upstream
+from schemas import Attraction, Geocode
+from upstream import CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT
 
-def get_place_names(location: str, query: Union[str, None] = None):
-    th = Toolhouse()
-    
-    client = Groq()
-    MODEL = "llama3-groq-70b-8192-tool-use-preview"
+MODEL = "llama3-groq-70b-8192-tool-use-preview"
+TOOLS_REFRESH_INTERVAL = float(os.getenv("TOOLHOUSE_TOOLS_REFRESH_INTERVAL", 15 * 60))
+GROQ_TIMEOUT = float(os.getenv("GROQ_TIMEOUT", 30))
+RECOMMENDATION_DEADLINE = float(os.getenv("RECOMMENDATION_DEADLINE", 90))
+
+SUBMIT_ATTRACTIONS_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "submit_attractions",
+        "description": "Submit the final list of attractions that were found",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "attractions": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "name": {"type": "string", "description": "Name of the attraction"},
+                            "lat": {"type": "number", "description": "Latitude, if known"},
+                            "lng": {"type": "number", "description": "Longitude, if known"}
+                        },
+                        "required": ["name"]
+                    }
+                }
+            },
+            "required": ["attractions"]
+        }
+    }
+}
+
+th: Union[Toolhouse, None] = None
+client: Union[Groq, None] = None
+tools: Union[list, None] = None
+
+recommendation_cache = TTLCache(
+    maxsize=int(os.getenv("RECOMMENDATION_CACHE_SIZE", 2000)),
+    ttl=float(os.getenv("RECOMMENDATION_CACHE_TTL", 6 * 60 * 60))
+)
+recommendation_flight = SingleFlight()
+
+def groq_retryable(error: Exception) -> bool:
+    if isinstance(error, groq.APIStatusError):
+        return error.status_code in RETRY_STATUSES
+    return isinstance(error, groq.APIConnectionError)
+
+def toolhouse_retryable(error: Exception) -> bool:
+    return isinstance(error, requests.RequestException) or getattr(error, "status_code", None) in RETRY_STATUSES
+
+# the Groq SDK's own retries are turned off so these policies are the only ones retrying
+groq_upstream = Upstream(
+    "groq",
+    CircuitBreaker("Groq", CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT),
+    float(os.getenv("GROQ_DEADLINE", 60)),
+    retryable=groq_retryable,
+    bucket=groq_bucket
+)
+# the Toolhouse SDK already retries 5xx on its own
+toolhouse_upstream = Upstream(
+    "toolhouse",
+    CircuitBreaker("Toolhouse", CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT),
+    float(os.getenv("TOOLHOUSE_DEADLINE", 60)),
+    retries=0,
+    retryable=toolhouse_retryable
+)
+
+def recommendation_key(location: str, query: Union[str, None] = None):
+    normalized_location = re.sub(r"[\s,]+", " ", location.lower()).strip()
+    keywords = " ".join(sorted(set(re.findall(r"\w+", query.lower())))) if query else ""
+    return (normalized_location, keywords)
+
+def init_clients():
+    global th, client
+    if th is None:
+        th = Toolhouse()
+    if client is None:
+        client = Groq(timeout=GROQ_TIMEOUT, max_retries=0)
+
+def refresh_tools():
+    global tools
+    init_clients()
+    tools = toolhouse_upstream.call_sync(th.get_tools)
+    return tools
+
+def get_tools():
+    if tools is None:
+        return refresh_tools()
+    return tools
+
+def open_connections():
+    refresh_tools()
+    # cheap authenticated call so the Groq TLS connection is already pooled
+    client.models.list()
+
+async def warm_up():
+    try:
+        await asyncio.to_thread(open_connections)
+    except Exception as e:
+        # not fatal, the first request will fetch the tools instead
+        print(f"Recommendation warm-up failed: {e}")
+
+async def refresh_tools_periodically():
+    while True:
+        await asyncio.sleep(TOOLS_REFRESH_INTERVAL)
+        try:
+            await asyncio.to_thread(refresh_tools)
+        except Exception as e:
+            print(f"Failed to refresh Toolhouse tools: {e}")
+
+async def get_attractions_cached(location: str, query: Union[str, None] = None) -> list[Attraction]:
+    key = recommendation_key(location, query)
+    cached = recommendation_cache.get(key)
+    if cached is not MISSING:
+        return cached
+
+    async def compute():
+        # up to two completions per recommendation, both are paid for up front
+        async with recommendation_admission.slot(cost=2):
+            attractions = await asyncio.to_thread(get_attractions, location, query)
+        recommendation_cache.set(key, attractions)
+        return attractions
+
+    # the worker thread can't be interrupted, but the request stops waiting and a late result still fills the cache
+    try:
+        return await asyncio.wait_for(recommendation_flight.do(key, compute), RECOMMENDATION_DEADLINE)
+    except asyncio.TimeoutError:
+        raise TimeoutError(f"Recommendations for {location} took longer than {RECOMMENDATION_DEADLINE:g} s")
+
+def parse_attractions(response) -> Union[list[Attraction], None]:
+    tool_calls = response.choices[0].message.tool_calls or []
+    for tool_call in tool_calls:
+        if tool_call.function.name != SUBMIT_ATTRACTIONS_TOOL["function"]["name"]:
+            continue
+
+        try:
+            arguments = json.loads(tool_call.function.arguments)
+        except json.JSONDecodeError:
+            return None
+
+        attractions = []
+        for item in arguments.get("attractions", []):
+            if not isinstance(item, dict) or not str(item.get("name", "")).strip():
+                continue
+
+            geocode = None
+            if isinstance(item.get("lat"), (int, float)) and isinstance(item.get("lng"), (int, float)):
+                geocode = Geocode(lat=item["lat"], lng=item["lng"])
+
+            attractions.append(Attraction(name=item["name"].strip(), geocode=geocode))
+
+        return attractions
+
+    return None
+
+def get_attractions(location: str, query: Union[str, None] = None) -> list[Attraction]:
+    init_clients()
 
     messages = [
         {
             "role": "system",
-            "content": f"""Find a relevant website with attractions in {location} and about the keywords: {query}, then scrape from one website 5 attractions in {location}, 
-            in a list format."""
+            "content": f"""Find a relevant website with attractions in {location} and about the keywords: {query}, then scrape from one website 5 attractions in {location}.
+            Report the attractions by calling submit_attractions with their names, and their coordinates if you know them.
+            If you already know 5 well-known attractions that fit, call submit_attractions right away."""
         }
     ]
 
-    response = client.chat.completions.create(
+    available_tools = get_tools() + [SUBMIT_ATTRACTIONS_TOOL]
+    response = groq_upstream.call_sync(lambda: client.chat.completions.create(
         model=MODEL,
         messages=messages,
         max_tokens=1000,
-        tools=th.get_tools()
-    )
+        tools=available_tools
+    ))
+
+    # answered in the tool-calling turn itself, no scrape or second completion needed
+    attractions = parse_attractions(response)
+    if attractions:
+        return attractions
 
-    tool_run = th.run_tools(response)
+    tool_run = toolhouse_upstream.call_sync(lambda: th.run_tools(response))
     messages = messages + tool_run
-    messages += [
-        {
-            "role": "user",
-            "content": """Return a list of the names of 5 attractions in a list format,
-            ex. [place1, place2, place3, place4, place5]"""
-        }
-    ]
 
     print(messages)
-    
-    final_response = client.chat.completions.create(
+
+    final_response = groq_upstream.call_sync(lambda: client.chat.completions.create(
         model=MODEL,
         messages=messages,
-        max_tokens=1000
-    )
+        max_tokens=1000,
+        tools=[SUBMIT_ATTRACTIONS_TOOL],
+        tool_choice={"type": "function", "function": {"name": SUBMIT_ATTRACTIONS_TOOL["function"]["name"]}}
+    ))
+
+    attractions = parse_attractions(final_response)
+    if attractions is None:
+        raise ValueError("Recommendation model did not return a list of attractions.")
 
-    return final_response.choices[0].message.content.strip().strip('[]').split(',')
\ No newline at end of file
+    return attractions
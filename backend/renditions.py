@@ -0,0 +1,34 @@
+import io
+import os
+import re
+from typing import Union
+from PIL import Image
+
+# longest side in pixels, FLUX renders are 1024x1024 so "full" keeps the original size
+RENDITIONS = {"thumb": 128, "page": 512, "full": 1024}
+WEBP_QUALITY = int(os.getenv("WEBP_QUALITY", 80))
+
+RENDITION_PATH = re.compile(r"^(.*)/(" + "|".join(RENDITIONS) + r")\.webp$")
+
+def rendition_path(base_name: str, rendition: str) -> str:
+    return f"{base_name}/{rendition}.webp"
+
+def rendition_paths(blob_name: Union[str, None]) -> Union[dict[str, str], None]:
+    # only images stored through encode_renditions have a set, older PNG blobs return None
+    match = RENDITION_PATH.match(blob_name or "")
+    if match is None:
+        return None
+    return {rendition: rendition_path(match.group(1), rendition) for rendition in RENDITIONS}
+
+def encode_renditions(image_data: bytes) -> dict[str, bytes]:
+    image = Image.open(io.BytesIO(image_data))
+    image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+
+    encoded = {}
+    for rendition, size in RENDITIONS.items():
+        resized = image.copy()
+        resized.thumbnail((size, size), Image.Resampling.LANCZOS)
+        output = io.BytesIO()
+        resized.save(output, format="WEBP", quality=WEBP_QUALITY, method=4)
+        encoded[rendition] = output.getvalue()
+    return encoded
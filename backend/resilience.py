@@ -0,0 +1,315 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Awaitable, Callable, TypeVar, Union
+import httpx
+
+T = TypeVar("T")
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", 20))
+
+class CircuitOpenError(httpx.HTTPError):
+    pass
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in RETRY_STATUSES
+    return isinstance(error, httpx.TransportError)
+
+def rate_limited(error: Exception) -> bool:
+    # httpx and the Groq SDK both keep the response on the error
+    return getattr(getattr(error, "response", None), "status_code", None) == 429
+
+def retry_after(error: Exception) -> Union[float, None]:
+    # only the delay-seconds form, an HTTP date is treated like a missing header
+    try:
+        return max(0.0, float(error.response.headers["Retry-After"]))
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+
+class TokenBucket:
+    # one bucket per upstream account, shared by every operation that counts against its rate limit
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, cost: int = 1) -> float:
+        # takes the tokens now, possibly going negative, and returns how long to wait until they were due
+        with self.lock:
+            self.refill()
+            self.tokens -= cost
+            return max(0.0, -self.tokens / self.rate)
+
+    def take(self, cost: int = 1) -> bool:
+        # takes the tokens only if they are there right now
+        with self.lock:
+            self.refill()
+            if self.tokens < cost:
+                return False
+            self.tokens -= cost
+            return True
+
+    def available(self) -> float:
+        with self.lock:
+            return min(self.burst, self.tokens + (time.monotonic() - self.updated) * self.rate)
+
+class CircuitBreaker:
+    # opens after failure_threshold consecutive failures, after reset_timeout one trial call
+    # is let through (half-open) and its outcome closes or re-opens the circuit
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Union[float, None] = None
+        self.trial = False
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if self.trial or time.monotonic() - self.opened_at >= self.reset_timeout else "open"
+
+    def allow(self) -> Union[str, None]:
+        # returns the permit the caller hands back when it settles: "trial" for the one half-open
+        # call, "normal" otherwise, or None when the call is refused
+        with self.lock:
+            if self.opened_at is None:
+                return "normal"
+            if not self.trial and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.trial = True
+                return "trial"
+            self.rejected += 1
+            return None
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def record_failure(self, permit: str):
+        with self.lock:
+            self.failures += 1
+            if permit == "trial" or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            if permit == "trial":
+                self.trial = False
+
+    def release(self, permit: str):
+        # a cancelled trial call proves nothing, the next caller gets to try instead; calls admitted
+        # before the circuit opened don't own the trial and leave it alone
+        if permit == "trial":
+            with self.lock:
+                self.trial = False
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state(),
+            "consecutive_failures": self.failures,
+            "rejected": self.rejected
+        }
+
+class LatencyTracker:
+    def __init__(self, window: int = 200, min_samples: int = HEDGE_MIN_SAMPLES):
+        self.samples: deque[float] = deque(maxlen=window)
+        self.min_samples = min_samples
+        self.lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def percentile(self, q: float) -> Union[float, None]:
+        with self.lock:
+            if len(self.samples) < self.min_samples:
+                return None
+            ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+class Upstream:
+    # deadline bounds the whole call including retries and hedges, the breaker may be shared by
+    # several operations against the same provider; the caller's admission slot pays for the first
+    # attempt, every retry and hedge after it takes its own token from bucket
+    def __init__(
+        self,
+        name: str,
+        breaker: CircuitBreaker,
+        deadline: float,
+        retries: int = 2,
+        hedge: bool = False,
+        backoff: float = 0.25,
+        retryable: Callable[[Exception], bool] = is_retryable,
+        bucket: Union[TokenBucket, None] = None
+    ):
+        self.name = name
+        self.breaker = breaker
+        self.deadline = deadline
+        self.retries = retries
+        self.hedge = hedge
+        self.backoff = backoff
+        self.retryable = retryable
+        self.bucket = bucket
+        self.latency = LatencyTracker()
+        self.retried = 0
+        self.hedged = 0
+        self.hedges_skipped = 0
+        self.deadline_exceeded = 0
+
+    def admit(self) -> str:
+        permit = self.breaker.allow()
+        if permit is None:
+            raise CircuitOpenError(f"{self.breaker.name} is unavailable, failing fast until it recovers")
+        return permit
+
+    def settle(self, permit: str, error: Union[Exception, None]):
+        # a 4xx still means the upstream is up, only retryable failures count against it
+        if error is None or not self.retryable(error):
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure(permit)
+
+    def backoff_delay(self, attempt: int) -> float:
+        # full jitter, so retries from concurrent requests don't arrive in lockstep
+        return random.uniform(0, self.backoff * 2 ** attempt)
+
+    def retry_delay(self, error: Exception, attempt: int, started: float) -> Union[float, None]:
+        # how long to wait before the next attempt, or None when the error should be raised instead
+        if attempt == self.retries or not self.retryable(error):
+            return None
+
+        delay = self.backoff_delay(attempt)
+        if rate_limited(error):
+            # a 429 is only worth retrying when the upstream says when, and that fits the deadline
+            wait = retry_after(error)
+            if wait is None:
+                return None
+            delay = max(delay, wait)
+
+        if time.monotonic() - started + delay >= self.deadline:
+            return None
+        return delay
+
+    def charge(self) -> float:
+        return self.bucket.reserve() if self.bucket is not None else 0.0
+
+    async def call(self, fn: Callable[[], Awaitable[T]]) -> T:
+        permit = self.admit()
+        settled = False
+        try:
+            result = await asyncio.wait_for(self.attempts(fn), self.deadline)
+        except asyncio.TimeoutError:
+            self.deadline_exceeded += 1
+            self.breaker.record_failure(permit)
+            settled = True
+            raise httpx.TimeoutException(f"{self.name} did not answer within its {self.deadline:g} s deadline")
+        except Exception as e:
+            self.settle(permit, e)
+            settled = True
+            raise
+        else:
+            self.settle(permit, None)
+            settled = True
+            return result
+        finally:
+            if not settled:
+                self.breaker.release(permit)
+
+    async def attempts(self, fn: Callable[[], Awaitable[T]]) -> T:
+        started = time.monotonic()
+        for attempt in range(self.retries + 1):
+            try:
+                return await (self.hedged_attempt(fn) if self.hedge else self.timed(fn))
+            except Exception as e:
+                delay = self.retry_delay(e, attempt, started)
+                if delay is None:
+                    raise
+                self.retried += 1
+                await asyncio.sleep(max(delay, self.charge()))
+
+    async def timed(self, fn: Callable[[], Awaitable[T]]) -> T:
+        start = time.monotonic()
+        result = await fn()
+        self.latency.record(time.monotonic() - start)
+        return result
+
+    async def hedged_attempt(self, fn: Callable[[], Awaitable[T]]) -> T:
+        # a second identical request goes out once the first is slower than p95, the first answer wins
+        pending = {asyncio.create_task(self.timed(fn))}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=self.latency.percentile(0.95))
+            if not done:
+                # a hedge only goes out on a spare token, it never queues behind the rate limit
+                if self.bucket is None or self.bucket.take():
+                    self.hedged += 1
+                    pending.add(asyncio.create_task(self.timed(fn)))
+                else:
+                    self.hedges_skipped += 1
+                    done, pending = await asyncio.wait(pending)
+
+            error = None
+            while True:
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+                if not pending:
+                    raise error
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def call_sync(self, fn: Callable[[], T]) -> T:
+        # for blocking SDK clients running on a worker thread, the SDK's own timeout bounds each attempt
+        permit = self.admit()
+        started = time.monotonic()
+        settled = False
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    start = time.monotonic()
+                    result = fn()
+                    self.latency.record(time.monotonic() - start)
+                    break
+                except Exception as e:
+                    delay = self.retry_delay(e, attempt, started)
+                    if delay is None:
+                        raise
+                    self.retried += 1
+                    time.sleep(max(delay, self.charge()))
+        except Exception as e:
+            self.settle(permit, e)
+            settled = True
+            raise
+        else:
+            self.settle(permit, None)
+            settled = True
+            return result
+        finally:
+            if not settled:
+                self.breaker.release(permit)
+
+    def stats(self) -> dict:
+        p95 = self.latency.percentile(0.95)
+        return {
+            "circuit": self.breaker.stats(),
+            "p95_ms": round(p95 * 1000) if p95 is not None else None,
+            "retries": self.retried,
+            "hedges": self.hedged,
+            "hedges_skipped": self.hedges_skipped,
+            "deadline_exceeded": self.deadline_exceeded
+        }
@@ -22,6 +22,10 @@ class Location(BaseModel):
     location_name: str
     geocode: Geocode
 
+class Attraction(BaseModel):
+    name: str
+    geocode: Union[Geocode, None] = None
+
 class Stamp(BaseModel):
     photo_url: str
     stamp_url: str
@@ -41,7 +45,8 @@ class Place(BaseModel):
     photo_uri: str
 
 class Book(BaseModel):
-    cover: str
-    pages: Union[dict[str, list[Location]], None] = None
+    cover: Union[str, None] = None
+    cover_status: Union[str, None] = None
+    pages: Union[dict[str, dict[str, Location]], None] = None
     city: str
     state: str
\ No newline at end of file
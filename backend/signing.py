@@ -0,0 +1,104 @@
+import os
+from datetime import datetime, timedelta
+from typing import Iterable, Union
+from urllib.parse import unquote, urlparse
+from firebase_admin import storage
+from cache import MISSING, TTLCache
+from fanout import fanout_executor
+from renditions import rendition_paths
+
+SIGNED_URL_LIFETIME = timedelta(days=7)
+URL_FIELDS = ("cover", "stamp_url", "photo_url", "profile_photo")
+
+# entries expire a day before the URLs they hold, so a URL handed out always has at least a day left
+signed_url_cache = TTLCache(
+    maxsize=int(os.getenv("SIGNED_URL_CACHE_SIZE", 20000)),
+    ttl=float(os.getenv("SIGNED_URL_CACHE_TTL", 6 * 24 * 60 * 60))
+)
+
+def is_blob_path(value: Union[str, None]) -> bool:
+    return bool(value) and not value.startswith(("http://", "https://"))
+
+def blob_path(value: Union[str, None]) -> Union[str, None]:
+    # signed URLs of our own bucket are stored as the blob path, anything else is kept as is
+    if not value or is_blob_path(value):
+        return value
+
+    url = urlparse(value)
+    bucket_name = storage.bucket().name
+    if url.netloc == "storage.googleapis.com" and url.path.startswith(f"/{bucket_name}/"):
+        return unquote(url.path[len(bucket_name) + 2:])
+    if url.netloc == f"{bucket_name}.storage.googleapis.com":
+        return unquote(url.path[1:])
+    return value
+
+def sign_blob(blob_name: str) -> str:
+    return storage.bucket().blob(blob_name).generate_signed_url(expiration=datetime.now() + SIGNED_URL_LIFETIME)
+
+def signed_url(blob_name: str) -> str:
+    url = signed_url_cache.get(blob_name)
+    if url is MISSING:
+        url = sign_blob(blob_name)
+        signed_url_cache.set(blob_name, url)
+    return url
+
+def sign_urls(values: Iterable[Union[str, None]]) -> dict[str, str]:
+    # stored values (blob paths, legacy signed URLs, external URLs) mapped to what clients should load
+    resolved = {}
+    missing = {}
+    for value in set(values):
+        path = blob_path(value)
+        if not is_blob_path(path):
+            continue
+
+        url = signed_url_cache.get(path)
+        if url is MISSING:
+            missing.setdefault(path, []).append(value)
+        else:
+            resolved[value] = url
+
+    if missing:
+        # signing may be a network call (IAM signBlob), so a whole listing is signed concurrently
+        for path, url in zip(missing, fanout_executor.map(sign_blob, missing)):
+            signed_url_cache.set(path, url)
+            for value in missing[path]:
+                resolved[value] = url
+
+    return resolved
+
+def resolve_url(value: Union[str, None]) -> Union[str, None]:
+    return sign_urls([value]).get(value, value)
+
+def renditions_field(field: str) -> str:
+    # "cover" -> "cover_renditions", "stamp_url" -> "stamp_renditions"
+    return field.removesuffix("_url") + "_renditions"
+
+def sign_records(records: list[dict], fields: tuple[str, ...] = URL_FIELDS) -> list[dict]:
+    renditions = {}
+    for record in records:
+        for field in fields:
+            if record.get(field) and record[field] not in renditions:
+                renditions[record[field]] = rendition_paths(blob_path(record[field]))
+
+    # the stored values and every rendition of them are signed in the same batch
+    urls = sign_urls([*renditions, *(path for paths in renditions.values() if paths for path in paths.values())])
+
+    signed = []
+    for record in records:
+        record = dict(record)
+        for field in fields:
+            value = record.get(field)
+            if value in urls:
+                record[field] = urls[value]
+            if renditions.get(value):
+                record[renditions_field(field)] = {rendition: urls[path] for rendition, path in renditions[value].items()}
+        signed.append(record)
+    return signed
+
+def sign_pages(pages: Union[dict[str, list], None]) -> Union[dict[str, list], None]:
+    if not pages:
+        return pages
+
+    letters = [(letter, len(entries)) for letter, entries in pages.items()]
+    signed = iter(sign_records([entry for entries in pages.values() for entry in entries]))
+    return {letter: [next(signed) for _ in range(count)] for letter, count in letters}
@@ -0,0 +1,230 @@
+import random
+import threading
+import time
+from typing import Any, Union
+from firebase_admin import db
+from fanout import fanout_executor
+from geo import geo_index_path, geo_index_updates
+
+PUSH_CHARS = "-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz"
+
+_push_lock = threading.Lock()
+_last_push_time = 0
+_last_random_chars = [0] * 12
+
+def push_id() -> str:
+    # same algorithm as the Firebase client SDKs: 8 timestamp chars + 12 random chars,
+    # incremented within the same millisecond so keys generated here still sort in creation order
+    global _last_push_time, _last_random_chars
+    with _push_lock:
+        now = int(time.time() * 1000)
+        if now == _last_push_time:
+            for i in range(11, -1, -1):
+                if _last_random_chars[i] != 63:
+                    _last_random_chars[i] += 1
+                    break
+                _last_random_chars[i] = 0
+        else:
+            _last_random_chars = [random.randrange(64) for _ in range(12)]
+        _last_push_time = now
+
+        time_chars = []
+        for _ in range(8):
+            time_chars.append(PUSH_CHARS[now % 64])
+            now //= 64
+
+        return "".join(reversed(time_chars)) + "".join(PUSH_CHARS[i] for i in _last_random_chars)
+
+def legacy_key(index: int) -> str:
+    # sorts before every real push key, so migrated stamps stay ahead of newer ones
+    return "-" * 8 + f"{index:012d}"
+
+def page_letter(location_name: str) -> str:
+    return location_name[0].upper()
+
+def entry_sort_key(key: str):
+    # legacy array entries ("0", "1", ...) come before push keys, in index order
+    return (0, int(key), "") if key.isdigit() else (1, 0, key)
+
+def stamp_entries(letter_node: Union[list, dict, None]) -> list[tuple[str, Any]]:
+    if not letter_node:
+        return []
+
+    if isinstance(letter_node, list):
+        return [(str(i), entry) for i, entry in enumerate(letter_node) if entry is not None]
+
+    return sorted(
+        ((key, entry) for key, entry in letter_node.items() if entry is not None),
+        key=lambda item: entry_sort_key(item[0])
+    )
+
+def normalize_pages(pages: Union[dict, None]) -> Union[dict[str, list], None]:
+    # pages used to be stored as one array per letter, now they are push-keyed maps,
+    # clients keep getting a list per letter either way
+    if pages is None:
+        return None
+
+    return {
+        letter: [{**entry, "stamp_id": key} for key, entry in stamp_entries(letter_node)]
+        for letter, letter_node in sorted(pages.items())
+    }
+
+def keyed_pages(entries: list[tuple[str, dict]]) -> dict[str, dict[str, dict]]:
+    pages: dict[str, dict[str, dict]] = {}
+    for location_name, entry in entries:
+        pages.setdefault(page_letter(location_name), {})[push_id()] = entry
+    return pages
+
+def stamp_path(uid: str, book_id: str, location_name: str, stamp_id: str) -> str:
+    return f"users/{uid}/books/{book_id}/pages/{page_letter(location_name)}/{stamp_id}"
+
+def book_index_root(uid: str) -> str:
+    # the per-user indexes (this one and geo.geo_index_path) live outside users/{uid}, so reading
+    # the account doesn't download them alongside the books
+    return f"book_index/{uid}"
+
+def book_index_path(uid: str, book_id: str) -> str:
+    return f"{book_index_root(uid)}/{book_id}"
+
+def count_stamps(pages: Union[dict, None]) -> int:
+    # attraction placeholders from create_book have no stamp yet
+    return sum(
+        1 for letter_node in (pages or {}).values() for _, entry in stamp_entries(letter_node) if "stamp_url" in entry
+    )
+
+def book_index_updates(uid: str, book_id: str, added: int) -> dict:
+    # server-side increments, so the summary never needs a read and concurrent writers can't clobber it
+    return {
+        f"{book_index_path(uid, book_id)}/stamp_count": {".sv": {"increment": added}},
+        f"{book_index_path(uid, book_id)}/last_updated": {".sv": "timestamp"}
+    }
+
+def book_exists(uid: str, book_id: str) -> bool:
+    return db.reference(f"/users/{uid}/books/{book_id}").get(shallow=True) is not None
+
+def add_stamps(stamps: list[tuple[str, str, dict]]) -> list[str]:
+    # one multi-location update, it either commits every stamp or none of them
+    stamp_ids = [push_id() for _ in stamps]
+    updates = {}
+    added: dict[tuple[str, str], int] = {}
+    for (uid, book_id, stamp), stamp_id in zip(stamps, stamp_ids):
+        updates[stamp_path(uid, book_id, stamp["location_name"], stamp_id)] = stamp
+        updates.update(geo_index_updates(uid, book_id, stamp_id, stamp))
+        added[(uid, book_id)] = added.get((uid, book_id), 0) + 1
+
+    for (uid, book_id), count in added.items():
+        updates.update(book_index_updates(uid, book_id, count))
+
+    db.reference("/").update(updates)
+    return stamp_ids
+
+def add_stamp(uid: str, book_id: str, stamp: dict) -> str:
+    return add_stamps([(uid, book_id, stamp)])[0]
+
+def pages_ref(uid: str, book_id: str):
+    return db.reference(f"/users/{uid}/books/{book_id}/pages")
+
+def page_letters(uid: str, book_id: str, start_letter: Union[str, None] = None, end_letter: Union[str, None] = None) -> list[str]:
+    letters = sorted(pages_ref(uid, book_id).get(shallow=True) or {})
+    return [
+        letter for letter in letters
+        if (start_letter is None or letter >= start_letter.upper()) and (end_letter is None or letter <= end_letter.upper())
+    ]
+
+def read_pages(uid: str, book_id: str, start_letter: Union[str, None] = None, end_letter: Union[str, None] = None) -> Union[dict, None]:
+    ref = pages_ref(uid, book_id)
+    if start_letter is None and end_letter is None:
+        return ref.get()
+
+    query = ref.order_by_key()
+    if start_letter is not None:
+        query = query.start_at(start_letter.upper())
+    if end_letter is not None:
+        query = query.end_at(end_letter.upper())
+    return query.get()
+
+def page_summary(uid: str, book_id: str) -> list[dict]:
+    # shallow reads only transfer keys, never stamp bodies
+    ref = pages_ref(uid, book_id)
+    letters = page_letters(uid, book_id)
+    counts = fanout_executor.map(lambda letter: len(ref.child(letter).get(shallow=True) or {}), letters)
+    return [{"letter": letter, "count": count} for letter, count in zip(letters, counts)]
+
+def parse_cursor(cursor: str) -> Union[tuple[str, str], None]:
+    # the cursor is "<letter>/<stamp_id>" of the last stamp the client already has, None when malformed
+    letter, _, stamp_id = cursor.partition("/")
+    if len(letter) != 1 or not stamp_id or "/" in stamp_id:
+        return None
+    return letter, stamp_id
+
+def read_stamp_page(
+    uid: str,
+    book_id: str,
+    limit: int,
+    cursor: Union[str, None] = None,
+    start_letter: Union[str, None] = None,
+    end_letter: Union[str, None] = None
+) -> tuple[dict[str, list], Union[str, None]]:
+    cursor_letter, cursor_id = parse_cursor(cursor) if cursor else (None, None)
+    ref = pages_ref(uid, book_id)
+
+    page: dict[str, list] = {}
+    fetched = 0
+    for letter in page_letters(uid, book_id, start_letter, end_letter):
+        if cursor_letter is not None and letter < cursor_letter:
+            continue
+
+        # one extra stamp is fetched so we know whether another page exists
+        query = ref.child(letter).order_by_key()
+        if letter == cursor_letter:
+            entries = stamp_entries(query.start_at(cursor_id).limit_to_first(limit - fetched + 2).get())
+            entries = [(key, entry) for key, entry in entries if key != cursor_id]
+        else:
+            entries = stamp_entries(query.limit_to_first(limit - fetched + 1).get())
+
+        for key, entry in entries:
+            if fetched == limit:
+                last_letter = next(reversed(page))
+                return page, f"{last_letter}/{page[last_letter][-1]['stamp_id']}"
+            page.setdefault(letter, []).append({**entry, "stamp_id": key})
+            fetched += 1
+
+    return page, None
+
+def migrate_pages(uid: str, book_id: str) -> int:
+    migrated = 0
+
+    def rewrite(pages):
+        nonlocal migrated
+        migrated = 0
+        if not pages:
+            return pages
+
+        for letter, letter_node in pages.items():
+            if isinstance(letter_node, list) or any(key.isdigit() for key in letter_node):
+                keyed = {}
+                for key, entry in stamp_entries(letter_node):
+                    if key.isdigit():
+                        key = legacy_key(int(key))
+                        migrated += 1
+                    keyed[key] = entry
+                pages[letter] = keyed
+        return pages
+
+    db.reference(f"/users/{uid}/books/{book_id}/pages").transaction(rewrite)
+    return migrated
+
+def rebuild_geo_index(uid: str) -> int:
+    # one-off backfill for stamps written before the geo index existed
+    books = db.reference(f"/users/{uid}/books").get() or {}
+    updates = {}
+    for book_id, book in books.items():
+        for letter_node in (book.get("pages") or {}).values():
+            for stamp_id, entry in stamp_entries(letter_node):
+                if "stamp_url" in entry and entry.get("geocode"):
+                    updates.update(geo_index_updates(uid, book_id, stamp_id, entry))
+
+    db.reference(f"/{geo_index_path(uid)}").delete()
+    if updates:
+        db.reference("/").update(updates)
+    return len(updates)
@@ -0,0 +1,72 @@
+import base64
+import io
+import json
+import os
+import sys
+import time
+import requests
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from preprocess import prepare_photo
+
+# run from backend/: python tests/bench_image_preprocess.py
+# set HYPERBOLIC_API_KEY to also time the vision call with and without preprocessing
+
+def phone_photo():
+    # a 12 MP photo like the ones phones upload, upscaled from a test image
+    img = Image.open("./tests/Geisel_Library,_UCSD.jpg").convert("RGB").resize((4032, 3024))
+    buffered = io.BytesIO()
+    img.save(buffered, format="JPEG", quality=95)
+    return buffered.getvalue()
+
+photos = {
+    "aerial-view-of-statue-of-liberty.jpg": open("./tests/aerial-view-of-statue-of-liberty.jpg", "rb").read(),
+    "Geisel_Library,_UCSD.jpg": open("./tests/Geisel_Library,_UCSD.jpg", "rb").read(),
+    "12mp_phone_photo.jpg": phone_photo(),
+}
+
+def payload(image_data, media_type):
+    base64_img = base64.b64encode(image_data).decode("utf-8")
+    return {
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": "Describe this image to someone who would draw it without the reference image. Make sure to be detailed."},
+                    {"type": "image_url", "image_url": {"url": f"data:{media_type};base64,{base64_img}"}},
+                ],
+            }
+        ],
+        "model": "meta-llama/Llama-3.2-90B-Vision-Instruct",
+        "max_tokens": 2048,
+        "temperature": 0.7,
+        "top_p": 0.9,
+    }
+
+def time_vision(body):
+    start = time.perf_counter()
+    response = requests.post(
+        "https://api.hyperbolic.xyz/v1/chat/completions",
+        headers={"Content-Type": "application/json", "Authorization": f"Bearer {os.getenv('HYPERBOLIC_API_KEY')}"},
+        data=body,
+    )
+    response.raise_for_status()
+    return time.perf_counter() - start
+
+for name, original in photos.items():
+    start = time.perf_counter()
+    for _ in range(5):
+        prepared, media_type = prepare_photo(original)
+    preprocess_ms = (time.perf_counter() - start) / 5 * 1000
+
+    before = json.dumps(payload(original, "image/jpeg"))
+    after = json.dumps(payload(prepared, media_type))
+
+    print(name)
+    print(f"  image:      {len(original) / 1024:8.0f} KB -> {len(prepared) / 1024:8.0f} KB  {Image.open(io.BytesIO(prepared)).size}")
+    print(f"  request:    {len(before) / 1024:8.0f} KB -> {len(after) / 1024:8.0f} KB")
+    print(f"  preprocess: {preprocess_ms:8.1f} ms")
+
+    if os.getenv("HYPERBOLIC_API_KEY"):
+        print(f"  vision:     {time_vision(before):8.2f} s  -> {time_vision(after):8.2f} s")
@@ -0,0 +1,15 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# these call the live APIs and Firebase at import time, run them by hand as scripts
+collect_ignore = [
+    "bench_image_preprocess.py",
+    "test_image_generation.py",
+    "test_langchain.py",
+    "test_llama_vision.py",
+    "test_llm_query.py",
+    "test_maps_tool.py",
+    "test_upload.py",
+]
@@ -0,0 +1,49 @@
+import random
+import pytest
+import geohash
+
+def random_points(box: tuple[float, float, float, float], count: int = 500):
+    min_lat, min_lng, max_lat, max_lng = box
+    rng = random.Random(0)
+    return [(rng.uniform(min_lat, max_lat), rng.uniform(min_lng, max_lng)) for _ in range(count)]
+
+def test_encode_known_value():
+    assert geohash.encode(57.64911, 10.40744, 11) == "u4pruydqqvj"
+
+def test_decode_contains_the_point():
+    min_lat, min_lng, max_lat, max_lng = geohash.decode(geohash.encode(32.8801, -117.2340, 7))
+    assert min_lat <= 32.8801 <= max_lat and min_lng <= -117.2340 <= max_lng
+
+BOXES = [
+    geohash.bounding_box(32.8801, -117.2340, 15),
+    geohash.bounding_box(40.7128, -74.0060, 2),
+    geohash.bounding_box(64.1466, -21.9426, 40),
+    # straddles the prime meridian and the equator
+    (-0.5, -0.5, 0.5, 0.5)
+]
+
+@pytest.mark.parametrize("box", BOXES)
+@pytest.mark.parametrize("max_cells", [4, 8, 16])
+def test_covering_cells_cover_the_box_within_budget(box, max_cells):
+    cells = geohash.covering_cells(*box, max_cells=max_cells)
+    assert 0 < len(cells) <= max_cells
+    assert len({len(cell) for cell in cells}) == 1
+
+    # every point of the box falls in one of the cells' prefix ranges
+    precision = len(next(iter(cells)))
+    for lat, lng in random_points(box):
+        assert geohash.encode(lat, lng, precision) in cells
+
+@pytest.mark.parametrize("box", BOXES)
+def test_covering_cells_pick_the_finest_precision_that_fits(box):
+    cells = geohash.covering_cells(*box, max_cells=8)
+    precision = len(next(iter(cells)))
+    if precision < 9:
+        assert len(geohash.cells_covering(*box, precision + 1)) > 8
+
+def test_bounding_box_contains_the_radius():
+    lat, lng, radius = 32.8801, -117.2340, 15
+    min_lat, min_lng, max_lat, max_lng = geohash.bounding_box(lat, lng, radius)
+    assert geohash.distance_km(lat, lng, max_lat, lng) == pytest.approx(radius, rel=0.01)
+    assert geohash.distance_km(lat, lng, lat, max_lng) == pytest.approx(radius, rel=0.01)
+    assert min_lat < lat < max_lat and min_lng < lng < max_lng
@@ -0,0 +1,150 @@
+import asyncio
+import httpx
+import pytest
+from resilience import CircuitBreaker, CircuitOpenError, TokenBucket, Upstream
+
+def status_error(status_code: int, headers: dict = None) -> httpx.HTTPStatusError:
+    request = httpx.Request("POST", "https://upstream.test")
+    response = httpx.Response(status_code, headers=headers or {}, request=request)
+    return httpx.HTTPStatusError(f"{status_code}", request=request, response=response)
+
+def open_breaker(reset_timeout: float = 0.0) -> CircuitBreaker:
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=reset_timeout)
+    breaker.record_failure(breaker.allow())
+    return breaker
+
+def test_breaker_opens_after_threshold():
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=60)
+    breaker.record_failure(breaker.allow())
+    assert breaker.state() == "closed"
+    breaker.record_failure(breaker.allow())
+    assert breaker.state() == "open"
+    assert breaker.allow() is None
+    assert breaker.rejected == 1
+
+def test_breaker_lets_one_trial_through():
+    breaker = open_breaker()
+    assert breaker.allow() == "trial"
+    assert breaker.allow() is None
+
+def test_only_the_trial_owner_releases_the_trial():
+    breaker = open_breaker()
+    permit = breaker.allow()
+    breaker.release("normal")
+    assert breaker.allow() is None
+    breaker.release(permit)
+    assert breaker.allow() == "trial"
+
+def test_failed_trial_reopens_and_successful_trial_closes():
+    breaker = open_breaker(reset_timeout=60)
+    breaker.opened_at -= 60
+    breaker.record_failure(breaker.allow())
+    assert breaker.state() == "open"
+
+    breaker.opened_at -= 60
+    breaker.allow()
+    breaker.record_success()
+    assert breaker.state() == "closed"
+    assert breaker.allow() == "normal"
+
+def test_retries_count_and_settle_success():
+    upstream = Upstream("test", CircuitBreaker("test"), deadline=5, retries=2, backoff=0)
+    calls = []
+
+    async def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise status_error(503)
+        return "ok"
+
+    assert asyncio.run(upstream.call(flaky)) == "ok"
+    assert len(calls) == 3
+    assert upstream.retried == 2
+    assert upstream.breaker.failures == 0
+
+def test_client_errors_are_not_retried_or_counted():
+    upstream = Upstream("test", CircuitBreaker("test"), deadline=5, retries=2, backoff=0)
+    calls = []
+
+    async def not_found():
+        calls.append(1)
+        raise status_error(404)
+
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(upstream.call(not_found))
+    assert len(calls) == 1
+    assert upstream.breaker.failures == 0
+
+def test_open_circuit_fails_fast():
+    upstream = Upstream("test", open_breaker(reset_timeout=60), deadline=5)
+
+    async def never():
+        raise AssertionError("the call should not go out")
+
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(upstream.call(never))
+
+def test_rate_limit_without_retry_after_is_not_retried():
+    upstream = Upstream("test", CircuitBreaker("test"), deadline=5, retries=2, backoff=0)
+    calls = []
+
+    async def limited():
+        calls.append(1)
+        raise status_error(429)
+
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(upstream.call(limited))
+    assert len(calls) == 1
+
+def test_rate_limit_honours_retry_after_within_the_deadline():
+    upstream = Upstream("test", CircuitBreaker("test"), deadline=5, retries=2, backoff=0)
+    calls = []
+
+    async def limited_once():
+        calls.append(1)
+        if len(calls) == 1:
+            raise status_error(429, {"Retry-After": "0"})
+        return "ok"
+
+    assert asyncio.run(upstream.call(limited_once)) == "ok"
+
+    calls.clear()
+
+    async def limited_for_long():
+        calls.append(1)
+        raise status_error(429, {"Retry-After": "60"})
+
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(upstream.call(limited_for_long))
+    assert len(calls) == 1
+
+def test_retries_are_charged_to_the_bucket():
+    bucket = TokenBucket(rate=1000, burst=5)
+    upstream = Upstream("test", CircuitBreaker("test"), deadline=5, retries=2, backoff=0, bucket=bucket)
+    bucket.rate = 1e-9
+
+    async def failing():
+        raise status_error(503)
+
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(upstream.call(failing))
+    assert bucket.tokens == pytest.approx(3)
+
+def test_hedge_goes_out_only_on_a_spare_token():
+    async def run(bucket: TokenBucket) -> Upstream:
+        upstream = Upstream("test", CircuitBreaker("test"), deadline=5, hedge=True, bucket=bucket)
+        upstream.latency.min_samples = 1
+        upstream.latency.record(0.01)
+
+        async def slow():
+            await asyncio.sleep(0.05)
+            return "ok"
+
+        assert await upstream.call(slow) == "ok"
+        return upstream
+
+    hedged = asyncio.run(run(TokenBucket(rate=1e-9, burst=1)))
+    assert (hedged.hedged, hedged.hedges_skipped) == (1, 0)
+
+    skipped = asyncio.run(run(TokenBucket(rate=1e-9, burst=0)))
+    assert (skipped.hedged, skipped.hedges_skipped) == (0, 1)
@@ -0,0 +1,85 @@
+import pytest
+import stamps
+from stamps import legacy_key, parse_cursor, push_id, read_stamp_page
+
+class FakeQuery:
+    # the slice of the RTDB query API read_stamp_page uses, over a plain dict
+    def __init__(self, node: dict):
+        self.node = node
+        self.start = None
+        self.limit = None
+
+    def order_by_key(self):
+        return self
+
+    def start_at(self, key: str):
+        self.start = key
+        return self
+
+    def limit_to_first(self, limit: int):
+        self.limit = limit
+        return self
+
+    def child(self, key: str):
+        return FakeQuery(self.node.get(key) or {})
+
+    def get(self, shallow: bool = False):
+        keys = sorted(key for key in self.node if self.start is None or key >= self.start)[:self.limit]
+        if not keys:
+            return None
+        return {key: True if shallow else self.node[key] for key in keys}
+
+@pytest.fixture
+def book(monkeypatch):
+    pages = {
+        "A": {push_id(): {"location_name": f"A{i}"} for i in range(3)},
+        "C": {push_id(): {"location_name": f"C{i}"} for i in range(2)},
+        "D": {push_id(): {"location_name": "D0"}}
+    }
+    monkeypatch.setattr(stamps, "pages_ref", lambda uid, book_id: FakeQuery(pages))
+    return pages
+
+def read_all(limit: int, **kwargs) -> list[list[str]]:
+    pages, cursor = [], None
+    while True:
+        page, cursor = read_stamp_page("uid", "book", limit, cursor, **kwargs)
+        pages.append([entry["location_name"] for entries in page.values() for entry in entries])
+        if cursor is None:
+            return pages
+
+def test_push_ids_sort_in_creation_order():
+    ids = [push_id() for _ in range(500)]
+    assert len(set(ids)) == len(ids)
+    assert sorted(ids) == ids
+    assert all(len(key) == 20 for key in ids)
+
+def test_legacy_keys_sort_before_push_ids():
+    assert legacy_key(0) < legacy_key(1) < legacy_key(10) < push_id()
+
+@pytest.mark.parametrize("cursor,expected", [
+    ("A/-Nabc", ("A", "-Nabc")),
+    ("A", None),
+    ("A/", None),
+    ("/-Nabc", None),
+    ("AB/-Nabc", None),
+    ("A/-Nabc/extra", None)
+])
+def test_parse_cursor(cursor, expected):
+    assert parse_cursor(cursor) == expected
+
+def test_pages_cover_every_stamp_once(book):
+    assert read_all(2) == [["A0", "A1"], ["A2", "C0"], ["C1", "D0"]]
+
+def test_page_boundary_on_the_last_stamp(book):
+    page, cursor = read_stamp_page("uid", "book", 6)
+    assert sum(len(entries) for entries in page.values()) == 6
+    assert cursor is None
+
+    page, cursor = read_stamp_page("uid", "book", 5)
+    assert cursor == f"C/{page['C'][-1]['stamp_id']}"
+    page, cursor = read_stamp_page("uid", "book", 5, cursor)
+    assert [entry["location_name"] for entry in page["D"]] == ["D0"]
+    assert list(page) == ["D"] and cursor is None
+
+def test_letter_range_limits_the_pages(book):
+    assert read_all(1, start_letter="c", end_letter="c") == [["C0"], ["C1"]]
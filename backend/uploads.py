@@ -0,0 +1,75 @@
+import hashlib
+import mimetypes
+import os
+import re
+import uuid
+from typing import BinaryIO, Union
+from firebase_admin import storage
+from google.api_core.exceptions import NotFound, PreconditionFailed
+
+# GCS resumable uploads need chunks in multiples of 256 KiB, smaller settings are raised to one
+UPLOAD_CHUNK_SIZE = max(256, int(os.getenv("UPLOAD_CHUNK_SIZE_KB", 8 * 1024))) // 256 * 256 * 1024
+UPLOAD_ID = re.compile(r"[0-9a-f]{32}")
+
+def photo_blob_name(photo_hash: str, content_type: Union[str, None]) -> str:
+    extension = mimetypes.guess_extension(content_type or "") or ""
+    return f"photos/{photo_hash}{extension}"
+
+def session_blob_name(upload_id: str) -> str:
+    return f"uploads/{upload_id}"
+
+def hash_stream(stream: BinaryIO) -> str:
+    photo_hash = hashlib.sha256()
+    while chunk := stream.read(UPLOAD_CHUNK_SIZE):
+        photo_hash.update(chunk)
+    return photo_hash.hexdigest()
+
+def photo_exists(blob_name: str) -> bool:
+    return storage.bucket().blob(blob_name).exists()
+
+def store_photo(file: BinaryIO, content_type: Union[str, None]) -> tuple[str, bool]:
+    # starlette already spools large uploads to disk, both passes over it read one chunk at a time
+    blob_name = photo_blob_name(hash_stream(file), content_type)
+    if photo_exists(blob_name):
+        return blob_name, False
+
+    file.seek(0)
+    blob = storage.bucket().blob(blob_name, chunk_size=UPLOAD_CHUNK_SIZE)
+    try:
+        # if_generation_match=0 only creates the blob, a concurrent upload of the same photo wins the race
+        blob.upload_from_file(file, content_type=content_type, if_generation_match=0)
+    except PreconditionFailed:
+        return blob_name, False
+    return blob_name, True
+
+def start_upload_session(content_type: Union[str, None], origin: Union[str, None] = None) -> tuple[str, str]:
+    # the client sends its chunks straight to GCS and can resume from the last committed byte
+    upload_id = uuid.uuid4().hex
+    blob = storage.bucket().blob(session_blob_name(upload_id), chunk_size=UPLOAD_CHUNK_SIZE)
+    session_url = blob.create_resumable_upload_session(content_type=content_type, origin=origin)
+    return upload_id, session_url
+
+def finish_upload_session(upload_id: str) -> Union[tuple[str, bool], None]:
+    if not UPLOAD_ID.fullmatch(upload_id):
+        return None
+
+    bucket = storage.bucket()
+    upload = bucket.blob(session_blob_name(upload_id))
+    try:
+        upload.reload()
+        with upload.open("rb", chunk_size=UPLOAD_CHUNK_SIZE) as stream:
+            blob_name = photo_blob_name(hash_stream(stream), upload.content_type)
+    except NotFound:
+        return None
+
+    uploaded = False
+    if not photo_exists(blob_name):
+        try:
+            # a server-side copy, the photo bytes don't pass through this process again
+            bucket.copy_blob(upload, bucket, blob_name, if_generation_match=0)
+            uploaded = True
+        except PreconditionFailed:
+            pass
+
+    upload.delete()
+    return blob_name, uploaded
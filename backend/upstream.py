@@ -0,0 +1,135 @@
+import json
+import os
+from typing import AsyncIterator, Union
+import httpx
+from admission import hyperbolic_bucket
+from resilience import RETRY_STATUSES, CircuitBreaker, Upstream
+
+HYPERBOLIC_URL = "https://api.hyperbolic.xyz/v1"
+PLACES_URL = "https://places.googleapis.com/v1"
+
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", 5))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", 30))
+
+hyperbolic_breaker = CircuitBreaker("Hyperbolic", CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT)
+places_breaker = CircuitBreaker("Google Places", CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT)
+
+# renders are too expensive to hedge, descriptions and place searches are cheap enough to send twice
+chat_upstream = Upstream(
+    "hyperbolic-chat", hyperbolic_breaker, float(os.getenv("HYPERBOLIC_CHAT_DEADLINE", 90)), hedge=True, bucket=hyperbolic_bucket
+)
+chat_stream_upstream = Upstream(
+    "hyperbolic-chat-stream", hyperbolic_breaker, float(os.getenv("HYPERBOLIC_STREAM_DEADLINE", 30)), bucket=hyperbolic_bucket
+)
+image_upstream = Upstream(
+    "hyperbolic-image", hyperbolic_breaker, float(os.getenv("HYPERBOLIC_IMAGE_DEADLINE", 180)), retries=1, bucket=hyperbolic_bucket
+)
+places_upstream = Upstream("places", places_breaker, float(os.getenv("PLACES_DEADLINE", os.getenv("PLACES_LOOKUP_TIMEOUT", 4))), hedge=True)
+
+class UpstreamClients:
+    def __init__(self):
+        self.hyperbolic = httpx.AsyncClient(
+            base_url=HYPERBOLIC_URL,
+            headers={
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {os.getenv('HYPERBOLIC_API_KEY')}"
+            },
+            limits=httpx.Limits(
+                max_connections=int(os.getenv("HYPERBOLIC_MAX_CONNECTIONS", 64)),
+                max_keepalive_connections=int(os.getenv("HYPERBOLIC_MAX_KEEPALIVE", 16))
+            ),
+            # FLUX renders routinely take 20-40 s, so only the read timeout is generous
+            timeout=httpx.Timeout(float(os.getenv("HYPERBOLIC_TIMEOUT", 120)), connect=10.0)
+        )
+
+        self.places = httpx.AsyncClient(
+            base_url=PLACES_URL,
+            headers={"X-Goog-Api-Key": os.getenv('GOOGLE_API_KEY') or ""},
+            limits=httpx.Limits(
+                max_connections=int(os.getenv("PLACES_MAX_CONNECTIONS", 32)),
+                max_keepalive_connections=int(os.getenv("PLACES_MAX_KEEPALIVE", 16))
+            ),
+            timeout=httpx.Timeout(float(os.getenv("PLACES_TIMEOUT", 10)), connect=5.0)
+        )
+
+    async def aclose(self):
+        await self.hyperbolic.aclose()
+        await self.places.aclose()
+
+clients: Union[UpstreamClients, None] = None
+
+async def startup():
+    global clients
+    if clients is None:
+        clients = UpstreamClients()
+
+async def shutdown():
+    global clients
+    if clients is not None:
+        await clients.aclose()
+        clients = None
+
+def get_clients() -> UpstreamClients:
+    if clients is None:
+        raise RuntimeError("Upstream clients are not initialized, startup() must run in the app lifespan.")
+    return clients
+
+async def post_json(client: httpx.AsyncClient, url: str, payload: dict) -> dict:
+    response = await client.post(url, json=payload)
+    response.raise_for_status()
+    return response.json()
+
+async def chat_completion(payload: dict) -> dict:
+    return await chat_upstream.call(lambda: post_json(get_clients().hyperbolic, "/chat/completions", payload))
+
+async def chat_completion_stream(payload: dict) -> AsyncIterator[str]:
+    client = get_clients().hyperbolic
+
+    async def open_stream() -> httpx.Response:
+        request = client.build_request("POST", "/chat/completions", json={**payload, "stream": True})
+        response = await client.send(request, stream=True)
+        if response.is_error:
+            await response.aclose()
+            response.raise_for_status()
+        return response
+
+    # retries and the deadline cover getting the stream started, tokens already sent can't be replayed
+    response = await chat_stream_upstream.call(open_stream)
+    try:
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                break
+
+            delta = json.loads(data).get('choices', [{}])[0].get('delta', {}).get('content')
+            if delta:
+                yield delta
+    finally:
+        await response.aclose()
+
+async def image_generation(data: dict) -> dict:
+    return await image_upstream.call(lambda: post_json(get_clients().hyperbolic, "/image/generation", data))
+
+async def search_text(text_query: str, field_mask: str, location_bias: Union[dict, None] = None) -> httpx.Response:
+    data = {"textQuery": text_query}
+    if location_bias:
+        data["locationBias"] = location_bias
+
+    async def post() -> httpx.Response:
+        response = await get_clients().places.post(
+            "/places:searchText",
+            headers={"X-Goog-FieldMask": field_mask},
+            json=data
+        )
+        if response.status_code in RETRY_STATUSES:
+            response.raise_for_status()
+        return response
+
+    try:
+        return await places_upstream.call(post)
+    except httpx.HTTPStatusError as e:
+        # retries are exhausted, callers still get the failed response like any other non-200
+        return e.response
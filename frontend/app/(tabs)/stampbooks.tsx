@@ -167,7 +167,7 @@ const BookCover: React.FC<{ item: Stampbook, index: number }> = ({ item, index }
       style={styles.bookContainer}
     >
       <View style={styles.bookCover}>
-        <Image source={{uri: item.cover}} style={{flex: 1, width: "100%", height: "100%"}}/>
+        <Image source={{uri: item.cover_renditions?.page ?? item.cover ?? undefined}} style={{flex: 1, width: "100%", height: "100%"}}/>
         <View style={styles.bookBinding} />
       </View>
       <Text style={styles.title}>{item.city}</Text>
@@ -7,7 +7,14 @@ export interface Stampbook {
   city: string;
   state: string;
   pages: PageDict;
-  cover: string;
+  cover: string | null;
+  cover_renditions?: Renditions;
+}
+
+export interface Renditions {
+  thumb: string;
+  page: string;
+  full: string;
 }
 
 export interface PageDict {